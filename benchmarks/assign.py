@@ -0,0 +1,64 @@
+"""Задержка POST /orders/assign/ в зависимости от размера очереди заказов
+
+    $ python -m benchmarks.assign --sizes 1000 10000 100000
+
+Курьер работает в одном регионе из --regions, поэтому число подходящих
+заказов растет медленнее, чем очередь свободных заказов.
+"""
+
+import json
+import argparse
+
+from benchmarks import utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--regions', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    utils.setup()
+
+    from django.db import transaction
+    from django.test import Client
+
+    from couriers.models import Courier
+    from orders.models import Order
+
+    rows = []
+
+    with utils.test_database():
+        regions = utils.create_regions(args.regions)
+
+        courier = Courier.objects.create(courier_type='car', working_hours='09:00-18:00')
+        courier.regions.add(regions[0])
+
+        client = Client()
+        created = 0
+
+        def assign():
+            with transaction.atomic():
+                response = client.post(
+                    '/orders/assign/',
+                    json.dumps({'courier_id': courier.id}),
+                    content_type='application/json')
+                transaction.set_rollback(True)
+
+            return json.loads(response.content)['orders']
+
+        for size in sorted(args.sizes):
+            utils.create_orders(size - created, regions, seed=size)
+            created = size
+
+            matched = len(assign())
+            ms = utils.measure(assign, args.repeat)
+
+            rows.append([Order.objects.count(), matched, '%.2f' % ms])
+
+    utils.print_table(['backlog', 'assigned', 'ms/call'], rows)
+
+
+if __name__ == '__main__':
+    main()
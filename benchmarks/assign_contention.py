@@ -0,0 +1,122 @@
+"""Одновременные POST /orders/assign/ из нескольких процессов
+
+    $ python -m benchmarks.assign_contention --workers 1 2 4 8
+
+В каждом регионе работает несколько курьеров с пересекающимся временем,
+все процессы одновременно вызывают assign для своих курьеров. Бенчмарк
+проверяет, что ни один заказ не был выдан дважды, и показывает число
+вызовов в секунду в зависимости от числа процессов.
+
+На SQLite база создается в файле, чтобы ее видели все процессы.
+"""
+
+import json
+import time
+import random
+import argparse
+import multiprocessing
+
+from benchmarks import utils
+
+
+def run_worker(courier_ids, start_event, results):
+    from django.db import connections
+    from django.test import Client
+
+    connections.close_all()
+    client = Client(raise_request_exception=False)
+    taken = []
+    errors = 0
+
+    start_event.wait()
+
+    for courier_id in courier_ids:
+        response = client.post(
+            '/orders/assign/',
+            json.dumps({'courier_id': courier_id}),
+            content_type='application/json')
+
+        if response.status_code != 200:
+            errors += 1
+            continue
+
+        taken.extend(o['id'] for o in json.loads(response.content)['orders'])
+
+    connections.close_all()
+    results.put((taken, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--regions', type=int, default=20)
+    parser.add_argument('--couriers', type=int, default=400)
+    parser.add_argument('--orders', type=int, default=20000)
+    args = parser.parse_args()
+
+    utils.setup()
+
+    from django.db import connections
+
+    from couriers.models import Courier
+    from orders.models import Order
+
+    rows = []
+    context = multiprocessing.get_context('fork')
+
+    with utils.test_database(name='bench_contention.sqlite3'):
+        regions = utils.create_regions(args.regions)
+        utils.create_orders(args.orders, regions, max_weight=10)
+
+        rnd = random.Random(0)
+        courier_ids = []
+
+        for _ in range(args.couriers):
+            courier = Courier.objects.create(
+                courier_type='car',
+                working_hours=';'.join(utils.random_hours(rnd, 2, 240, 600)))
+            courier.regions.add(rnd.choice(regions))
+            courier_ids.append(courier.id)
+
+        for workers in args.workers:
+            Order.objects.update(courier=None, assign_time=None)
+            connections.close_all()
+
+            start_event = context.Event()
+            results = context.Queue()
+            processes = [
+                context.Process(target=run_worker,
+                                args=(courier_ids[i::workers], start_event, results))
+                for i in range(workers)
+            ]
+
+            for process in processes:
+                process.start()
+
+            start = time.perf_counter()
+            start_event.set()
+
+            taken = []
+            errors = 0
+
+            for _ in processes:
+                worker_taken, worker_errors = results.get()
+                taken.extend(worker_taken)
+                errors += worker_errors
+
+            elapsed = time.perf_counter() - start
+
+            for process in processes:
+                process.join()
+
+            assigned = Order.objects.filter(courier__isnull=False).count()
+            duplicates = len(taken) - len(set(taken))
+
+            rows.append([workers, len(taken), assigned, duplicates, errors,
+                         '%.0f' % (len(courier_ids) / elapsed)])
+
+    utils.print_table(['workers', 'returned', 'assigned', 'duplicates', 'errors', 'calls/sec'], rows)
+
+
+if __name__ == '__main__':
+    main()
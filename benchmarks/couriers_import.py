@@ -0,0 +1,60 @@
+"""Пропускная способность POST /couriers/ в курьерах в секунду
+
+    $ python -m benchmarks.couriers_import --sizes 100 1000 10000
+"""
+
+import json
+import random
+import argparse
+
+from benchmarks import utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--regions', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    utils.setup()
+
+    from django.db import connection, transaction
+    from django.test import Client
+
+    rows = []
+
+    with utils.test_database():
+        regions = [r.id for r in utils.create_regions(args.regions)]
+        rnd = random.Random(0)
+        client = Client()
+
+        for size in args.sizes:
+            body = json.dumps({'data': [
+                {
+                    'courier_id': i + 1,
+                    'courier_type': rnd.choice(['foot', 'bike', 'car']),
+                    'regions': rnd.sample(regions, rnd.randint(1, 5)),
+                    'working_hours': utils.random_hours(rnd, rnd.randint(1, 3)),
+                }
+                for i in range(size)
+            ]})
+
+            def post():
+                with transaction.atomic():
+                    response = client.post('/couriers/', body, content_type='application/json')
+                    transaction.set_rollback(True)
+
+                assert response.status_code == 201, response.content
+
+            with utils.QueryCounter(connection) as queries:
+                post()
+
+            ms = utils.measure(post, args.repeat)
+            rows.append([size, queries.count, '%.1f' % ms, '%.0f' % (size / ms * 1000)])
+
+    utils.print_table(['couriers', 'queries', 'ms/call', 'couriers/sec'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Векторизованная проверка заказов (couriers.matching) против can_assign_order
+
+    $ python -m benchmarks.matching --orders 1000000 --couriers 1000
+
+Заказы и курьеры генерируются в памяти, база данных не нужна. Скалярная
+проверка слишком медленная для всех пар, поэтому она считается на
+--scalar-couriers курьерах, пересчитывается на всех курьеров и заодно
+сверяется с векторизованным результатом.
+"""
+
+import time
+import random
+import argparse
+from decimal import Decimal
+from types import SimpleNamespace
+
+from benchmarks import utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--couriers', type=int, default=1000)
+    parser.add_argument('--regions', type=int, default=100)
+    parser.add_argument('--scalar-couriers', type=int, default=5)
+    args = parser.parse_args()
+
+    utils.setup()
+
+    from couriers import matching
+    from couriers.models import Courier
+    from orders.intervals import parse_hours
+
+    if matching.np is None:
+        parser.exit(1, 'numpy не установлен\n')
+
+    rnd = random.Random(0)
+
+    orders = [
+        SimpleNamespace(
+            id=i + 1,
+            weight=Decimal(rnd.randint(1, 5000)) / 100,
+            region_id=rnd.randrange(args.regions),
+            delivery_intervals=parse_hours(';'.join(utils.random_hours(rnd, rnd.randint(1, 3)))))
+        for i in range(args.orders)
+    ]
+
+    couriers = []
+
+    for i in range(args.couriers):
+        courier = Courier(
+            id=i + 1,
+            courier_type=rnd.choice(['foot', 'bike', 'car']),
+            working_hours=';'.join(utils.random_hours(rnd, rnd.randint(1, 3), 60, 480)))
+        courier.region_ids = frozenset(rnd.sample(range(args.regions), rnd.randint(1, 5)))
+        couriers.append(courier)
+
+    start = time.perf_counter()
+    columns = matching.OrderColumns(
+        [o.id for o in orders],
+        [o.weight for o in orders],
+        [o.region_id for o in orders],
+        [o.delivery_intervals for o in orders])
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorised = columns.eligible_by_courier(couriers)
+    vectorised_time = time.perf_counter() - start
+
+    sample = couriers[:args.scalar_couriers]
+
+    start = time.perf_counter()
+    scalar = {c.id: [o.id for o in orders if c.can_assign_order(o)] for c in sample}
+    scalar_time = (time.perf_counter() - start) / len(sample) * len(couriers)
+
+    mismatches = sum(list(vectorised[c.id]) != scalar[c.id] for c in sample)
+
+    utils.print_table(['step', 'seconds'], [
+        ['build columns (%d orders)' % len(orders), '%.2f' % build],
+        ['vectorised, %d couriers' % len(couriers), '%.2f' % vectorised_time],
+        ['scalar, %d couriers (estimated)' % len(couriers), '%.1f' % scalar_time],
+    ])
+    print('pairs checked: %d, mismatches on sample: %d' % (len(orders) * len(couriers), mismatches))
+
+
+if __name__ == '__main__':
+    main()
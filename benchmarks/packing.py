@@ -0,0 +1,81 @@
+"""Скорость и качество подбора заказов под грузоподъемность (pack_orders)
+
+    $ python -m benchmarks.packing
+
+Скорость измеряется на списках кандидатов разного размера. Качество -
+отношение веса, набранного pack_orders, к оптимальному весу, найденному
+точным перебором сумм (динамика по весу в сотых долях килограмма).
+"""
+
+import random
+import argparse
+import statistics
+from decimal import Decimal
+from types import SimpleNamespace
+
+from benchmarks import utils
+
+
+def random_orders(rnd, count, max_weight):
+    return [
+        SimpleNamespace(id=i, weight=Decimal(rnd.randint(1, max_weight * 100)) / 100)
+        for i in range(count)
+    ]
+
+
+def optimal_load(orders, capacity):
+    """ Максимальный вес подмножества заказов, не превышающий capacity """
+
+    limit = int(capacity * 100)
+    reachable = 1
+
+    for order in orders:
+        reachable |= reachable << int(order.weight * 100)
+
+    reachable &= (1 << (limit + 1)) - 1
+
+    return Decimal(reachable.bit_length() - 1) / 100
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--quality-sizes', type=int, nargs='+', default=[5, 10, 20, 50])
+    parser.add_argument('--trials', type=int, default=200)
+    args = parser.parse_args()
+
+    from couriers.models import Courier
+    from couriers.packing import pack_orders
+
+    rnd = random.Random(0)
+
+    rows = []
+
+    for size in args.sizes:
+        orders = random_orders(rnd, size, 50)
+        ms = utils.measure(lambda: pack_orders(orders, Courier.LIFTION_CAPACITY['car']))
+        rows.append([size, '%.3f' % ms])
+
+    utils.print_table(['candidates', 'ms/call'], rows)
+    print()
+
+    rows = []
+
+    for courier_type, capacity in Courier.LIFTION_CAPACITY.items():
+        for size in args.quality_sizes:
+            ratios = []
+
+            for _ in range(args.trials):
+                orders = random_orders(rnd, size, capacity)
+                packed = sum(o.weight for o in pack_orders(orders, capacity))
+                best = optimal_load(orders, capacity)
+                ratios.append(float(packed / best) if best else 1.0)
+
+            rows.append([courier_type, size, '%.3f' % statistics.mean(ratios), '%.3f' % min(ratios)])
+
+    utils.print_table(['courier', 'candidates', 'mean fill/opt', 'worst fill/opt'], rows)
+
+
+if __name__ == '__main__':
+    utils.setup()
+    main()
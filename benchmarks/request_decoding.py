@@ -0,0 +1,66 @@
+"""Стоимость разбора и проверки тела POST /couriers/ на 10k курьеров
+
+    $ python -m benchmarks.request_decoding --items 10000
+
+Сравнивается прежний разбор полей формы через eval, литералы Python через
+ast.literal_eval и JSON-тело через стандартный json и orjson (если установлен).
+Проверка схемы COURIERS_SCHEMA входит в каждое измерение, кроме eval.
+"""
+
+import ast
+import json
+import random
+import argparse
+
+from benchmarks import utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    utils.setup()
+
+    from core import parsers
+    from couriers.views import COURIERS_SCHEMA
+
+    rnd = random.Random(0)
+    items = [
+        {
+            'courier_id': i + 1,
+            'courier_type': rnd.choice(['foot', 'bike', 'car']),
+            'regions': rnd.sample(range(1, 100), rnd.randint(1, 5)),
+            'working_hours': utils.random_hours(rnd, rnd.randint(1, 3)),
+        }
+        for i in range(args.items)
+    ]
+
+    form_values = [repr(item) for item in items]
+    body = json.dumps({'data': items}).encode()
+
+    decoders = [
+        ('eval (form)', lambda: [eval(v) for v in form_values]),
+        ('ast.literal_eval (form)', lambda: COURIERS_SCHEMA(
+            {'data': [ast.literal_eval(v) for v in form_values]})),
+        ('json', lambda: COURIERS_SCHEMA(json.loads(body))),
+    ]
+
+    if parsers.orjson is not None:
+        decoders.append(('orjson', lambda: COURIERS_SCHEMA(parsers.orjson.loads(body))))
+
+    rows = []
+
+    for name, decode in decoders:
+        ms = utils.measure(decode, args.repeat)
+        rows.append([name, '%.1f' % ms, '%.2f' % (ms * 1000 / args.items)])
+
+    rows.append(['schema only', '%.1f' % utils.measure(
+        lambda: COURIERS_SCHEMA({'data': items}), args.repeat), ''])
+
+    utils.print_table(['decoder', 'ms/batch', 'us/item'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Кодирование ответа со списком курьеров
+
+    $ python -m benchmarks.response_encoding --couriers 50000
+
+Сравнивается django.http.JsonResponse и core.responses.JsonResponse
+с orjson (если установлен) и со стандартным json.
+"""
+
+import random
+import argparse
+from decimal import Decimal
+from unittest import mock
+
+from benchmarks import utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--couriers', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    utils.setup()
+
+    from django import http
+    from core import responses
+
+    rnd = random.Random(0)
+    data = {'couriers': [
+        {
+            'courier_id': i + 1,
+            'courier_type': rnd.choice(['foot', 'bike', 'car']),
+            'regions': rnd.sample(range(1, 100), rnd.randint(1, 5)),
+            'working_hours': utils.random_hours(rnd, rnd.randint(1, 3)),
+            'rating': Decimal(rnd.randint(0, 500)) / 100,
+            'earnings': rnd.randint(0, 100) * 1000,
+        }
+        for i in range(args.couriers)
+    ]}
+
+    rows = [['django JsonResponse', '%.1f' % utils.measure(
+        lambda: http.JsonResponse(data), args.repeat)]]
+
+    if responses.orjson is not None:
+        rows.append(['core JsonResponse (orjson)', '%.1f' % utils.measure(
+            lambda: responses.JsonResponse(data), args.repeat)])
+
+    with mock.patch.object(responses, 'orjson', None):
+        rows.append(['core JsonResponse (json)', '%.1f' % utils.measure(
+            lambda: responses.JsonResponse(data), args.repeat)])
+
+    utils.print_table(['encoder', 'ms/response'], rows)
+
+
+if __name__ == '__main__':
+    main()
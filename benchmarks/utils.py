@@ -0,0 +1,227 @@
+"""Общие утилиты бенчмарков
+
+Бенчмарки запускаются как модули из корня проекта, например:
+
+    $ python -m benchmarks.assign
+
+Каждый бенчмарк создает отдельную тестовую базу данных и удаляет ее
+после завершения, рабочая база не затрагивается.
+"""
+
+import io
+import os
+import json
+import sys
+import math
+import time
+import random
+import statistics
+import contextlib
+
+import django
+
+from core.testing import QueryCounter
+
+
+def setup():
+    """ Инициализация Django с локальными настройками """
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.local')
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database(name=None):
+    """Временная тестовая база данных
+
+    Args:
+        name (str): имя тестовой базы (для sqlite - путь к файлу),
+            по умолчанию используется стандартное имя Django
+    """
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    if name:
+        connection.settings_dict['TEST']['NAME'] = name
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    try:
+        yield connection.settings_dict['NAME']
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def random_hours(rnd, count=1, min_length=30, max_length=240):
+    """ Список случайных промежутков формата %H:%M-%H:%M """
+
+    hours = []
+
+    for _ in range(count):
+        start = rnd.randrange(0, 24 * 60 - max_length)
+        end = start + rnd.randrange(min_length, max_length)
+        hours.append('%02d:%02d-%02d:%02d' % (start // 60, start % 60, end // 60, end % 60))
+
+    return hours
+
+
+def create_regions(count):
+    from orders.models import Region
+
+    Region.objects.bulk_create([Region(name='region %d' % i) for i in range(count)])
+    return list(Region.objects.order_by('id'))
+
+
+def create_orders(count, regions, seed=0, max_weight=50, batch_size=5000):
+    """ Создание count свободных заказов в случайных регионах """
+
+    from orders.models import Order
+
+    rnd = random.Random(seed)
+    orders = []
+
+    for _ in range(count):
+        order = Order(
+            weight=round(rnd.uniform(0.01, max_weight), 2),
+            region=rnd.choice(regions),
+        )
+        order.set_delivery_hours(random_hours(rnd, rnd.randint(1, 3)))
+        order.set_delivery_bounds()
+        orders.append(order)
+
+    Order.objects.bulk_create(orders, batch_size=batch_size)
+
+
+def measure(func, repeat=5):
+    """Время выполнения функции
+
+    Returns:
+        float: медианное время одного вызова в миллисекундах
+    """
+
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(timings)
+
+
+def percentile(values, p):
+    """ Перцентиль по методу ближайшего ранга, values должны быть отсортированы """
+
+    if not values:
+        return 0
+
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def wsgi_request(application, method, path, data=None, query=''):
+    """Вызов WSGI приложения напрямую, без сети и тестового клиента
+
+    Запрос проходит весь путь обработки: middleware, url-ы, view
+    и чтение потокового тела ответа.
+
+    Args:
+        application: WSGI приложение
+        method (str): HTTP метод
+        path (str): путь запроса
+        data: тело запроса, кодируется в json
+        query (str): строка запроса
+
+    Returns:
+        tuple: (код ответа, тело ответа в байтах)
+    """
+
+    body = json.dumps(data).encode() if data is not None else b''
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(int(status_line.split()[0]))
+
+    response = application(environ, start_response)
+
+    try:
+        content = b''.join(response)
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+
+    return status[0], content
+
+
+async def asgi_request(application, method, path, data=None, query=''):
+    """Вызов ASGI приложения напрямую, аналог wsgi_request
+
+    Returns:
+        tuple: (код ответа, тело ответа в байтах)
+    """
+
+    body = json.dumps(data).encode() if data is not None else b''
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [
+            (b'host', b'testserver'),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': ('testserver', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = []
+    content = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        else:
+            content.append(message.get('body', b''))
+
+    await application(scope, receive, send)
+
+    return status[0], b''.join(content)
+
+
+def print_table(header, rows, write=print):
+    widths = [max(len(str(v)) for v in column) for column in zip(header, *rows)]
+
+    for row in [header] + rows:
+        write('  '.join(str(v).rjust(w) for v, w in zip(row, widths)))
@@ -0,0 +1,158 @@
+"""Синхронный WSGI против async view под ASGI при 500 одновременных клиентах
+
+    $ python -m benchmarks.wsgi_vs_asgi --clients 500 --requests 10
+
+Оба приложения вызываются в одном процессе, без сети, и работают с одной
+и той же базой. WSGI обслуживает --wsgi-workers запросов одновременно
+(как sync воркеры gunicorn), ASGI - все запросы в одном цикле событий,
+работа с базой идет в пуле из --threads потоков (ASYNC_VIEW_THREADS).
+
+Сценарии: read - GET /couriers/<id>/, assign - POST /orders/assign/.
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import threading
+
+from benchmarks import utils
+
+
+def run_wsgi(application, requests, workers):
+    """ Все клиенты в отдельных потоках, одновременно обслуживается workers запросов """
+
+    gate = threading.Semaphore(workers)
+    timings = []
+    errors = []
+
+    def client(calls):
+        for method, path, data in calls:
+            start = time.perf_counter()
+
+            with gate:
+                status, _ = utils.wsgi_request(application, method, path, data)
+
+            timings.append((time.perf_counter() - start) * 1000)
+
+            if status >= 400:
+                errors.append(status)
+
+    threads = [threading.Thread(target=client, args=(calls,)) for calls in requests]
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return timings, len(errors), time.perf_counter() - start
+
+
+def run_asgi(application, requests):
+    """ Все клиенты - корутины одного цикла событий """
+
+    timings = []
+    errors = []
+
+    async def client(calls):
+        for method, path, data in calls:
+            start = time.perf_counter()
+            status, _ = await utils.asgi_request(application, method, path, data)
+            timings.append((time.perf_counter() - start) * 1000)
+
+            if status >= 400:
+                errors.append(status)
+
+    async def main():
+        await asyncio.gather(*[client(calls) for calls in requests])
+
+    start = time.perf_counter()
+    asyncio.run(main())
+
+    return timings, len(errors), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=10, help='запросов на клиента')
+    parser.add_argument('--scenarios', nargs='+', default=['read', 'assign'], choices=['read', 'assign'])
+    parser.add_argument('--wsgi-workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--couriers', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--regions', type=int, default=20)
+    args = parser.parse_args()
+
+    utils.setup()
+
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+
+    from couriers.models import Courier
+    from orders.models import Order
+    from core.asyncviews import AsyncViewsHandler
+
+    settings.ASYNC_VIEW_THREADS = args.threads
+    rows = []
+
+    # SQLite база создается в файле, чтобы ее видели потоки пула
+    with utils.test_database(name='bench_asgi.sqlite3'):
+        regions = utils.create_regions(args.regions)
+        utils.create_orders(args.orders, regions, max_weight=10)
+
+        rnd = random.Random(0)
+        Courier.bulk_from_json([
+            {
+                'courier_id': i,
+                'courier_type': rnd.choice(['foot', 'bike', 'car']),
+                'regions': [rnd.choice(regions).id],
+                'working_hours': utils.random_hours(rnd, 2, 240, 600),
+            }
+            for i in range(1, args.couriers + 1)
+        ])
+
+        applications = [
+            ('wsgi', get_wsgi_application()),
+            ('asgi', AsyncViewsHandler()),
+        ]
+
+        for scenario in args.scenarios:
+            requests = []
+
+            for _ in range(args.clients):
+                calls = []
+
+                for _ in range(args.requests):
+                    courier_id = rnd.randint(1, args.couriers)
+
+                    if scenario == 'read':
+                        calls.append(('GET', '/couriers/%d/' % courier_id, None))
+                    else:
+                        calls.append(('POST', '/orders/assign/', {'courier_id': courier_id}))
+
+                requests.append(calls)
+
+            for name, application in applications:
+                Order.objects.update(courier=None, assign_time=None)
+
+                if name == 'wsgi':
+                    timings, errors, elapsed = run_wsgi(application, requests, args.wsgi_workers)
+                else:
+                    timings, errors, elapsed = run_asgi(application, requests)
+
+                timings.sort()
+                rows.append([
+                    scenario, name, len(timings), errors,
+                    '%.0f' % (len(timings) / elapsed),
+                    '%.1f' % utils.percentile(timings, 50),
+                    '%.1f' % utils.percentile(timings, 99),
+                ])
+
+    utils.print_table(['scenario', 'server', 'requests', 'errors', 'req/sec', 'p50 ms', 'p99 ms'], rows)
+
+
+if __name__ == '__main__':
+    main()
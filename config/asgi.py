@@ -3,14 +3,24 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Эндпоинты API отдаются async view (config/urls_async.py), которые
+выполняют работу с базой в пуле потоков, поэтому один процесс
+обрабатывает много запросов одновременно, например:
+
+    $ uvicorn config.asgi:application --workers 3
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.local')
+
+django.setup(set_prefix=False)
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+from core.asyncviews import AsyncViewsHandler
 
-application = get_asgi_application()
+application = AsyncViewsHandler()
@@ -39,6 +39,7 @@ DATABASES = {
 }
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,6 +69,36 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'config.wsgi.application'
 
+# Кэш ответов GET /couriers/<id>/ (couriers/cache.py). Локальная память
+# не общая для процессов, в production используется файловый кэш
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# URL-ы и размер пула потоков для async view под ASGI (config/asgi.py)
+ASYNC_URLCONF = 'config.urls_async'
+ASYNC_VIEW_THREADS = 16
+
+# Доля запросов, для которых собираются метрики /metrics/ (core/middleware.py)
+METRICS_SAMPLE_RATE = 1.0
+
+# 'sync' - статистика курьера обновляется при завершении заказа,
+# 'queue' - ставится задача, которую выполняет process_stats_jobs
+STATS_UPDATE_MODE = 'sync'
+
+# Индекс свободных заказов в памяти воркера (orders.index) для assign и dispatch,
+# обновляется по журналу OrderChange и строится заново не реже чем раз в MAX_AGE секунд.
+# Каждое изменение заказов блокирует общую строку счетчика версий до коммита,
+# поэтому перед включением на PostgreSQL нужен замер под нагрузкой
+OPEN_ORDER_INDEX = False
+OPEN_ORDER_INDEX_MAX_AGE = 300
+
+# Проверка, какие заказы может взять курьер, в assign и dispatch:
+# 'python' - Courier.can_assign_order, 'numpy' - векторно (couriers.matching, нужен numpy)
+MATCHING_ENGINE = 'python'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
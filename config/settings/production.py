@@ -2,3 +2,37 @@ from .base import *
 
 DEBUG = False
 
+METRICS_SAMPLE_RATE = 0.1
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/yandex_couriers_cache',
+        'TIMEOUT': 24 * 60 * 60,
+    }
+}
+
+# Метрики запросов из выборки пишутся строками JSON в stderr (журнал gunicorn),
+# туда же - ошибки пересчета статистики курьеров
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'core.metrics': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'couriers': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
@@ -18,11 +18,14 @@ from django.contrib import admin
 from django.conf import settings
 from django.urls import path, include
 
+from core import views as core_views
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('couriers/', include('couriers.urls', namespace='couriers')),
-    path('orders/', include('orders.urls', namespace='orders'))
+    path('orders/', include('orders.urls', namespace='orders')),
+    path('metrics/', core_views.metrics),
 ]
 
 
@@ -0,0 +1,17 @@
+"""URL-ы для ASGI: те же эндпоинты, что и в config/urls.py, но с async view
+
+Подключается через ASYNC_URLCONF в core.asyncviews.AsyncViewsHandler (config/asgi.py).
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+from core import views as core_views
+from core.asyncviews import async_urls
+
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path('couriers/', include(async_urls('couriers.urls'), namespace='couriers')),
+    path('orders/', include(async_urls('orders.urls'), namespace='orders')),
+    path('metrics/', core_views.metrics),
+]
@@ -0,0 +1,154 @@
+"""Async версии view для работы под ASGI сервером
+
+Под ASGI Django выполняет синхронные view в одном потоке
+(thread_sensitive), поэтому процесс обрабатывает один запрос за раз.
+Здесь синхронная view выполняется в ограниченном пуле потоков
+ASYNC_VIEW_THREADS, а цикл событий в это время принимает другие запросы.
+"""
+
+import asyncio
+import functools
+import contextvars
+from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.core.handlers.asgi import ASGIHandler
+from django.urls import path
+
+from core.metrics import current_sample
+
+
+_executor = None
+
+
+def get_executor():
+    """ Пул потоков для view, создается при первом запросе """
+
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ASYNC_VIEW_THREADS', 16),
+            thread_name_prefix='async-view')
+
+    return _executor
+
+
+def _call(func, *args, **kwargs):
+    """Вызов в потоке пула
+
+    Соединения с базой закрываются по тем же правилам, что и после
+    обычного запроса (CONN_MAX_AGE), запросы попадают в метрики запроса.
+    """
+
+    sample = current_sample()
+    close_old_connections()
+
+    try:
+        if sample is None:
+            return func(*args, **kwargs)
+
+        with sample.track_queries():
+            return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """ Выполнение синхронной функции в пуле потоков с текущим контекстом """
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(
+        get_executor(),
+        functools.partial(context.run, _call, func, *args, **kwargs))
+
+
+def async_view(view):
+    """ Async view, которая выполняет синхронную view в пуле потоков """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await run_in_pool(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_urls(urlconf):
+    """Url-ы приложения, в которых все view заменены на async_view
+
+    Использование: path('orders/', include(async_urls('orders.urls'), namespace='orders'))
+
+    Args:
+        urlconf (str): модуль с urlpatterns и app_name
+    """
+
+    module = import_module(urlconf)
+    patterns = [
+        path(str(pattern.pattern), async_view(pattern.callback), name=pattern.name)
+        for pattern in module.urlpatterns
+    ]
+
+    return patterns, module.app_name
+
+
+class AsyncViewsHandler(ASGIHandler):
+    """ASGI обработчик, который разрешает url-ы по ASYNC_URLCONF
+
+    Тело потокового ответа генерируется по частям в пуле потоков
+    (Django 3.1 перебирает его синхронно в цикле событий, где запросы
+    к базе запрещены), каждая часть отправляется клиенту сразу.
+    """
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+
+        if request is not None:
+            request.urlconf = settings.ASYNC_URLCONF
+
+        return request, error_response
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [
+            (header.encode('ascii'), value.encode('latin1'))
+            for header, value in response.items()
+        ]
+        headers.extend(
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        )
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': headers,
+        })
+
+        # Генератор ответа продолжается в одном и том же контексте,
+        # хотя части генерируются в разных потоках пула
+        context = contextvars.copy_context()
+        parts = iter(response)
+
+        try:
+            while True:
+                part = await run_in_pool(context.run, next, parts, None)
+
+                if part is None:
+                    break
+
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+
+            await send({'type': 'http.response.body'})
+        finally:
+            await run_in_pool(response.close)
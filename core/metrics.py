@@ -0,0 +1,239 @@
+"""Метрики запросов API
+
+Для каждого эндпоинта копятся число запросов, число SQL запросов и время:
+общее, в базе данных, на кодирование ответа и остальное время Python.
+Метрики хранятся в памяти процесса, каждый воркер gunicorn отдает свои.
+"""
+
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+from django.db import connections
+
+
+# Границы гистограммы числа SQL запросов на один HTTP запрос
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+# Контекстная, а не thread-local переменная: async view выполняют запросы
+# к базе в пуле потоков (core.asyncviews), контекст копируется туда вместе с ней
+_current = contextvars.ContextVar('metrics_sample', default=None)
+
+
+def current_sample():
+    """ Метрики текущего запроса или None, если запрос не попал в выборку """
+
+    return _current.get()
+
+
+class RequestSample:
+    """Метрики одного запроса
+
+    Args:
+        method (str): HTTP метод
+    """
+
+    def __init__(self, method):
+        self.method = method
+        self.endpoint = None
+        self.status = None
+        self.queries = 0
+        self.db_time = 0
+        self.serialization_time = 0
+        self.total_time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    @property
+    def python_time(self):
+        return max(self.total_time - self.db_time - self.serialization_time, 0)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """Сбор метрик внутри блока
+
+        Запросы ко всем базам данных считаются через execute_wrapper,
+        время кодирования добавляет core.responses.dumps.
+        """
+
+        previous = current_sample()
+        start = time.perf_counter()
+        _current.set(self)
+
+        try:
+            with self.track_queries():
+                yield self
+        finally:
+            _current.set(previous)
+            self.total_time += time.perf_counter() - start
+
+    @contextlib.contextmanager
+    def track_queries(self):
+        """ Подсчет запросов к базам данных из текущего потока """
+
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+
+            yield self
+
+    def wrap_stream(self, content, on_finish):
+        """Потоковое тело ответа, генерация которого тоже входит в метрики
+
+        Сбор включается заново на каждую часть: под ASGI части генерируются
+        в разных потоках пула (core.asyncviews), а execute_wrapper ставится
+        только на соединения текущего потока.
+        """
+
+        content = iter(content)
+
+        try:
+            while True:
+                with self.activate():
+                    part = next(content, None)
+
+                if part is None:
+                    break
+
+                yield part
+        finally:
+            on_finish(self)
+
+    def as_dict(self):
+        return {
+            'endpoint': self.endpoint,
+            'method': self.method,
+            'status': self.status,
+            'queries': self.queries,
+            'total_ms': round(self.total_time * 1000, 3),
+            'db_ms': round(self.db_time * 1000, 3),
+            'serialization_ms': round(self.serialization_time * 1000, 3),
+            'python_ms': round(self.python_time * 1000, 3),
+        }
+
+
+class EndpointStats:
+    """ Накопленные метрики эндпоинта """
+
+    def __init__(self):
+        self.statuses = {}
+        self.count = 0
+        self.queries = 0
+        self.total_time = 0
+        self.db_time = 0
+        self.serialization_time = 0
+        self.python_time = 0
+        self.query_buckets = [0] * len(QUERY_BUCKETS)
+
+    def add(self, sample):
+        self.statuses[sample.status] = self.statuses.get(sample.status, 0) + 1
+        self.count += 1
+        self.queries += sample.queries
+        self.total_time += sample.total_time
+        self.db_time += sample.db_time
+        self.serialization_time += sample.serialization_time
+        self.python_time += sample.python_time
+
+        bucket = bisect.bisect_left(QUERY_BUCKETS, sample.queries)
+
+        if bucket < len(QUERY_BUCKETS):
+            self.query_buckets[bucket] += 1
+
+
+class Registry:
+    """ Метрики всех эндпоинтов процесса """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, sample):
+        with self.lock:
+            key = sample.endpoint, sample.method
+
+            if key not in self.endpoints:
+                self.endpoints[key] = EndpointStats()
+
+            self.endpoints[key].add(sample)
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def get(self, endpoint, method):
+        return self.endpoints.get((endpoint, method))
+
+    def render(self, sample_rate=1.0):
+        """Метрики в текстовом формате Prometheus
+
+        Args:
+            sample_rate (float): доля запросов, попадающих в метрики
+
+        Returns:
+            str: текст для ответа на /metrics/
+        """
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+
+            lines = [
+                '# HELP api_metrics_sample_rate Доля запросов, попадающих в метрики',
+                '# TYPE api_metrics_sample_rate gauge',
+                'api_metrics_sample_rate %s' % sample_rate,
+                '# HELP api_requests_total Число запросов',
+                '# TYPE api_requests_total counter',
+            ]
+
+            for (endpoint, method), stats in endpoints:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append('api_requests_total{%s,status="%s"} %d' % (
+                        _labels(endpoint, method), status, count))
+
+            counters = [
+                ('api_request_seconds_total', 'Общее время обработки', 'total_time'),
+                ('api_db_seconds_total', 'Время SQL запросов', 'db_time'),
+                ('api_serialization_seconds_total', 'Время кодирования ответов', 'serialization_time'),
+                ('api_python_seconds_total', 'Время Python без базы и кодирования', 'python_time'),
+            ]
+
+            for name, description, attr in counters:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s counter' % name)
+
+                for (endpoint, method), stats in endpoints:
+                    lines.append('%s{%s} %.6f' % (
+                        name, _labels(endpoint, method), getattr(stats, attr)))
+
+            lines.append('# HELP api_db_queries Число SQL запросов на один запрос')
+            lines.append('# TYPE api_db_queries histogram')
+
+            for (endpoint, method), stats in endpoints:
+                labels = _labels(endpoint, method)
+                cumulative = 0
+
+                for bound, count in zip(QUERY_BUCKETS, stats.query_buckets):
+                    cumulative += count
+                    lines.append('api_db_queries_bucket{%s,le="%d"} %d' % (labels, bound, cumulative))
+
+                lines.append('api_db_queries_bucket{%s,le="+Inf"} %d' % (labels, stats.count))
+                lines.append('api_db_queries_sum{%s} %d' % (labels, stats.queries))
+                lines.append('api_db_queries_count{%s} %d' % (labels, stats.count))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(endpoint, method):
+    endpoint = endpoint.replace('\\', '\\\\').replace('"', '\\"')
+    return 'endpoint="%s",method="%s"' % (endpoint, method)
+
+
+registry = Registry()
@@ -0,0 +1,90 @@
+import json
+import random
+import asyncio
+import logging
+
+from django.conf import settings
+
+from core.metrics import RequestSample, registry
+
+
+logger = logging.getLogger('core.metrics')
+
+
+def metrics_exempt(view):
+    """ Не собирать метрики для view (например, для самого /metrics/) """
+
+    view.metrics_exempt = True
+    return view
+
+
+class MetricsMiddleware:
+    """Число SQL запросов и время обработки по эндпоинтам
+
+    В выборку попадает доля запросов METRICS_SAMPLE_RATE (от 0 до 1),
+    остальные запросы проходят без накладных расходов. Для каждого
+    запроса из выборки пишется строка в логгер core.metrics в формате JSON,
+    накопленные метрики отдаются на /metrics/ в формате Prometheus.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+
+        if asyncio.iscoroutinefunction(get_response):
+            # Как в MiddlewareMixin: ASGI обработчик вызывает __call__ как корутину
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        if not self.sampled():
+            return self.get_response(request)
+
+        sample = RequestSample(request.method)
+
+        with sample.activate():
+            response = self.get_response(request)
+
+        return self.process_sample(request, response, sample)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        sample = RequestSample(request.method)
+
+        with sample.activate():
+            response = await self.get_response(request)
+
+        return self.process_sample(request, response, sample)
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def process_sample(self, request, response, sample):
+        match = request.resolver_match
+
+        if match and getattr(match.func, 'metrics_exempt', False):
+            return response
+
+        sample.endpoint = '/' + match.route if match else 'unmatched'
+        sample.status = response.status_code
+
+        if response.streaming:
+            response.streaming_content = sample.wrap_stream(
+                response.streaming_content, self.finish)
+        else:
+            self.finish(sample)
+
+        return response
+
+    def finish(self, sample):
+        registry.record(sample)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(sample.as_dict()))
@@ -0,0 +1,260 @@
+"""Разбор тел запросов API
+
+Тело разбирается быстрым JSON-декодером (orjson, если он установлен,
+иначе стандартный json) и проверяется заранее скомпилированной схемой.
+Слишком большие запросы отклоняются по заголовку Content-Length,
+до чтения тела. Тела в формате NDJSON читаются построчно (iter_json_lines),
+ограничение размера действует на каждую строку.
+"""
+
+import ast
+import json
+
+from django.conf import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """ Разбор JSON из bytes или str """
+
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+class RequestDataError(Exception):
+    """ Тело запроса не удалось разобрать или оно не прошло проверку """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class SchemaError(RequestDataError):
+    pass
+
+
+def compile_schema(schema, path='body'):
+    """Компиляция схемы в функцию проверки
+
+    Поддерживается небольшое подмножество JSON Schema:
+    type (object, array, integer, number, string), required,
+    properties, additionalProperties (только False) и items.
+
+    Args:
+        schema (dict): описание схемы
+        path (str): путь до значения, используется в сообщениях об ошибках
+
+    Returns:
+        function: validate(value), бросает SchemaError
+    """
+
+    checks = []
+    expected = schema.get('type')
+
+    if expected:
+        types = SCHEMA_TYPES[expected]
+
+        def check_type(value):
+            if not isinstance(value, types) or isinstance(value, bool) and bool not in types:
+                raise SchemaError('%s: ожидается %s' % (path, expected))
+
+        checks.append(check_type)
+
+    required = schema.get('required')
+
+    if required:
+        def check_required(value):
+            for field in required:
+                if field not in value:
+                    raise SchemaError('%s: не задано поле %s' % (path, field))
+
+        checks.append(check_required)
+
+    properties = {
+        field: compile_schema(subschema, '%s.%s' % (path, field))
+        for field, subschema in schema.get('properties', {}).items()
+    }
+
+    if properties:
+        def check_properties(value):
+            for field, validate in properties.items():
+                if field in value:
+                    validate(value[field])
+
+        checks.append(check_properties)
+
+    if schema.get('additionalProperties') is False:
+        allowed = frozenset(schema.get('properties', ()))
+
+        def check_additional(value):
+            for field in value:
+                if field not in allowed:
+                    raise SchemaError('%s: неизвестное поле %s' % (path, field))
+
+        checks.append(check_additional)
+
+    items = schema.get('items')
+
+    if items:
+        validate_item = compile_schema(items, path + '[]')
+
+        def check_items(value):
+            for item in value:
+                validate_item(item)
+
+        checks.append(check_items)
+
+    def validate(value):
+        for check in checks:
+            check(value)
+
+        return value
+
+    return validate
+
+
+SCHEMA_TYPES = {
+    'object': (dict,),
+    'array': (list,),
+    'integer': (int,),
+    'number': (int, float),
+    'string': (str,),
+}
+
+
+def decode_value(value):
+    """Разбор JSON
+
+    Raises:
+        RequestDataError: значение не разбирается
+    """
+
+    try:
+        return loads(value)
+    except ValueError:
+        raise RequestDataError('Тело запроса не является корректным JSON')
+
+
+def decode_form_value(value):
+    """Значение поля формы, исходная строка, если оно не разбирается
+
+    Кроме JSON принимаются литералы Python: так поля формы отправляет
+    тестовый клиент Django. Они разбираются ast.literal_eval, который,
+    в отличие от eval, не выполняет код. Тела остальных типов
+    разбираются только как JSON (decode_value).
+    """
+
+    try:
+        return loads(value)
+    except ValueError:
+        pass
+
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return value
+
+
+def decode_body(request, validate, form_lists=()):
+    """Разбор и проверка тела запроса
+
+    Args:
+        request (HttpRequest): запрос
+        validate (function): функция проверки из compile_schema
+        form_lists (tuple[str]): поля формы, которые передаются списком значений
+
+    Returns:
+        dict: проверенные данные запроса
+
+    Raises:
+        RequestDataError: тело слишком большое, не разбирается
+            или не соответствует схеме
+    """
+
+    max_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise RequestDataError('Некорректный заголовок Content-Length')
+
+    if max_size is not None and content_length > max_size:
+        raise RequestDataError('Тело запроса больше %d байт' % max_size, status=413)
+
+    if request.content_type in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        data = {
+            field: ([decode_form_value(v) for v in request.POST.getlist(field)]
+                    if field in form_lists else decode_form_value(request.POST[field]))
+            for field in request.POST
+        }
+    elif request.content_type == 'application/json':
+        try:
+            data = loads(request.body)
+        except ValueError:
+            raise RequestDataError('Тело запроса не является корректным JSON')
+    else:
+        data = decode_value(request.body)
+
+    return validate(data)
+
+
+def iter_json_lines(request, validate, max_line_size=None):
+    """Построчный разбор тела в формате NDJSON (по значению JSON на строку)
+
+    Тело читается из потока запроса по строке, целиком в памяти оно
+    не держится. Пустые строки пропускаются.
+
+    Args:
+        request (HttpRequest): запрос
+        validate (function): функция проверки строки из compile_schema
+        max_line_size (int): максимальная длина строки в байтах,
+            по умолчанию DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    Yields:
+        проверенное значение каждой строки
+
+    Raises:
+        RequestDataError: строка слишком длинная, не разбирается
+            или не соответствует схеме
+    """
+
+    if max_line_size is None:
+        max_line_size = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+
+    line_number = 0
+
+    while True:
+        line = request.readline(max_line_size + 1 if max_line_size is not None else None)
+
+        if not line:
+            break
+
+        line_number += 1
+
+        if max_line_size is not None and len(line) > max_line_size and not line.endswith(b'\n'):
+            raise RequestDataError(
+                'Строка %d больше %d байт' % (line_number, max_line_size), status=413)
+
+        line = line.strip()
+
+        if not line:
+            continue
+
+        try:
+            value = loads(line)
+        except ValueError:
+            raise RequestDataError('Строка %d не является корректным JSON' % line_number)
+
+        try:
+            value = validate(value)
+        except SchemaError as e:
+            raise SchemaError('Строка %d: %s' % (line_number, e.message))
+
+        yield value
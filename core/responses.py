@@ -0,0 +1,76 @@
+"""Ответы API в формате JSON
+
+Кодирование идет через orjson, если он установлен, иначе через стандартный
+json. Даты и Decimal в обоих случаях кодируются как в DjangoJSONEncoder
+(Decimal - строкой, время - в ISO 8601 с миллисекундами и Z для UTC),
+поэтому разобранные ответы не зависят от кодировщика. Побайтно они
+различаются: orjson не ставит пробелов после разделителей и не
+экранирует не-ASCII символы.
+
+Время кодирования учитывается в метриках запроса (core.metrics).
+"""
+
+import json
+import time
+
+from django.http import HttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+
+from core.metrics import current_sample
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_default = DjangoJSONEncoder().default
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data):
+    """Кодирование данных в JSON
+
+    Returns:
+        bytes: закодированные данные
+    """
+
+    sample = current_sample()
+
+    if sample is None:
+        return _dumps(data)
+
+    start = time.perf_counter()
+
+    try:
+        return _dumps(data)
+    finally:
+        sample.serialization_time += time.perf_counter() - start
+
+
+def _dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=_ORJSON_OPTIONS)
+
+    return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class JsonResponse(HttpResponse):
+    """Замена django.http.JsonResponse с быстрым кодировщиком
+
+    Args:
+        data: данные ответа
+        safe (bool): разрешать только словари на верхнем уровне
+    """
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the '
+                'safe parameter to False.'
+            )
+
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
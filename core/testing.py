@@ -0,0 +1,76 @@
+"""Утилиты тестов: бюджет SQL запросов
+
+Бюджет задается как функция размера входных данных: постоянное число
+запросов плюс, если нужно, фиксированное число запросов на элемент.
+Тест падает, как только в горячий путь добавляется запрос на каждую
+строку (N+1).
+"""
+
+from django.db import connection, transaction
+
+
+class QueryCounter:
+    """Счетчик SQL запросов соединения
+
+    В отличие от CaptureQueriesContext не зависит от сброса
+    connection.queries в начале каждого запроса тестового клиента.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = self.connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wrapper.__exit__(*exc_info)
+
+
+class QueryBudgetMixin:
+    """ Проверка числа запросов в зависимости от размера данных для TestCase """
+
+    QUERY_BUDGET_SIZES = (1, 10, 100)
+
+    def assertQueryBudget(self, prepare, max_queries, per_item=0, sizes=None):
+        """Число запросов не превышает max_queries + per_item * n
+
+        Для каждого размера n данные готовятся и проверяются внутри
+        транзакции, которая затем откатывается, поэтому размеры
+        не влияют друг на друга.
+
+        Args:
+            prepare (callable): prepare(n) создает данные размера n и
+                возвращает функцию без аргументов, запросы которой считаются
+            max_queries (int): постоянная часть бюджета
+            per_item (int): допустимое число запросов на элемент
+            sizes (iterable[int]): размеры, по умолчанию QUERY_BUDGET_SIZES
+
+        Returns:
+            dict: {размер: число запросов}
+        """
+
+        counts = {}
+
+        for n in sizes or self.QUERY_BUDGET_SIZES:
+            with transaction.atomic():
+                call = prepare(n)
+
+                with QueryCounter(connection) as counter:
+                    call()
+
+                counts[n] = counter.count
+                transaction.set_rollback(True)
+
+        over = {n: count for n, count in counts.items() if count > max_queries + per_item * n}
+
+        if over:
+            self.fail('Превышен бюджет запросов %d + %d * n: %s' % (max_queries, per_item, counts))
+
+        return counts
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.http import HttpResponse
+
+from core.metrics import registry
+from core.middleware import metrics_exempt
+
+
+@metrics_exempt
+def metrics(request):
+    """ Метрики запросов процесса в текстовом формате Prometheus """
+
+    return HttpResponse(
+        registry.render(getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
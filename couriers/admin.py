@@ -4,3 +4,5 @@ from couriers import models
 
 
 admin.site.register(models.Courier)
+admin.site.register(models.CourierStats)
+admin.site.register(models.StatsUpdateJob)
@@ -0,0 +1,90 @@
+"""Кэш ответа GET /couriers/<id>/
+
+У каждого курьера в кэше лежит текущая версия, ответ хранится под ключом
+с версией. При изменении курьера версия удаляется, следующее чтение
+заводит новую, поэтому старые ответы и ETag больше не используются.
+Версия проверяется без запросов к базе, что позволяет отвечать 304
+на условные запросы (If-None-Match).
+
+Подходит любой бэкенд кэша Django: в разработке - локальная память,
+в production - файловый кэш, общий для всех воркеров gunicorn.
+"""
+
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+def version_key(courier_id):
+    return 'courier:%s:version' % courier_id
+
+
+def detail_key(courier_id, version):
+    return 'courier:%s:%s:detail' % (courier_id, version)
+
+
+def get_version(courier_id, create=False):
+    """Текущая версия данных курьера
+
+    Args:
+        courier_id (int): id курьера
+        create (bool): завести новую версию, если ее нет в кэше
+
+    Returns:
+        str: версия или None
+    """
+
+    version = cache.get(version_key(courier_id))
+
+    if version is None and create:
+        cache.add(version_key(courier_id), uuid.uuid4().hex)
+        version = cache.get(version_key(courier_id))
+
+    return version
+
+
+def make_etag(courier_id, version):
+    return '"%s-%s"' % (courier_id, version)
+
+
+def get_detail(courier_id, load):
+    """Закодированный ответ по курьеру из кэша или от load
+
+    Версия заводится до чтения из базы: если курьер изменится во время
+    чтения, версия будет удалена и устаревший ответ больше не выдастся.
+
+    Args:
+        courier_id (int): id курьера
+        load (callable): load() возвращает тело ответа в байтах или None,
+            если курьера нет
+
+    Returns:
+        tuple: (тело ответа или None, ETag)
+    """
+
+    version = get_version(courier_id, create=True)
+    content = cache.get(detail_key(courier_id, version))
+
+    if content is None:
+        content = load()
+
+        if content is None:
+            return None, None
+
+        cache.set(detail_key(courier_id, version), content)
+
+    return content, make_etag(courier_id, version)
+
+
+def invalidate(*courier_ids):
+    """Сброс кэша курьеров
+
+    Версия удаляется сразу и еще раз после коммита транзакции, чтобы
+    ответ, прочитанный из базы до коммита, не закэшировался под новой версией.
+    """
+
+    keys = [version_key(i) for i in courier_ids]
+
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
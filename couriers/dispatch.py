@@ -0,0 +1,222 @@
+"""Распределение всех свободных заказов между всеми курьерами за один проход
+
+Заказы раскладываются по корзинам (район, слот времени доставки), курьеры
+просматривают только корзины своих районов и слотов рабочего времени,
+поэтому общая работа пропорциональна числу заказов и курьеров, а не их
+произведению. Заказы для курьера выбираются по тому же правилу, что и
+pack_orders в assign.
+"""
+
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+from math import inf
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from couriers.matching import OrderColumns, use_numpy
+from couriers.models import Courier
+from orders.bulk import objects_by_ids, update_cases_by_ids
+from orders.index import bucket_orders, open_orders
+from orders.intervals import interval_slots, intervals_overlap
+from orders.models import Order, OrderChange
+
+
+def match_orders(couriers, orders, loads):
+    """Подбор заказов для курьеров без обращений к базе данных
+
+    Для каждого курьера корзины его районов и рабочих слотов сливаются
+    в порядке убывания веса (как в pack_orders - first-fit-decreasing),
+    заказы тяжелее оставшейся грузоподъемности пропускаются бинарным
+    поиском, поэтому курьер просматривает только заказы, которые
+    может взять. Выбранные заказы удаляются из корзин. Время доставки
+    проверяется движком из MATCHING_ENGINE (couriers.matching).
+
+    Args:
+        couriers (list[Courier]): курьеры с загруженными регионами
+        orders (list[Order]): свободные заказы
+        loads (dict): вес недоставленных заказов по id курьера
+
+    Returns:
+        dict: {курьер: [выбранные заказы]}
+    """
+
+    if not orders:
+        return {}
+
+    orders_by_id = {order.id: order for order in orders}
+    buckets = bucket_orders(orders)
+    lightest = min(order.weight for order in orders)
+    columns = OrderColumns.from_orders(orders) if use_numpy() else None
+    matches = {}
+
+    for courier in sorted(couriers, key=lambda c: c.id):
+        free = courier.lifting_capacity - loads.get(courier.id, 0)
+        working_intervals = courier.working_intervals
+        eligible = set(columns.eligible_ids(courier).tolist()) if columns else None
+        heap = []
+
+        for region_id in courier.region_ids:
+            for slot in interval_slots(working_intervals):
+                key = region_id, slot
+                bucket = buckets.get(key)
+
+                if bucket:
+                    push_heaviest(heap, bucket, key, len(bucket), free)
+
+        chosen = []
+        seen = set()
+
+        while heap and free >= lightest:
+            weight, order_id, key, position = heappop(heap)
+            weight = -weight
+
+            if weight <= free and order_id not in seen:
+                seen.add(order_id)
+                order = orders_by_id[order_id]
+
+                if eligible is not None:
+                    fits = order_id in eligible
+                else:
+                    fits = intervals_overlap(working_intervals, order.delivery_intervals)
+
+                if fits:
+                    chosen.append(order)
+                    free -= weight
+
+            push_heaviest(heap, buckets[key], key, position, free)
+
+        for order in chosen:
+            for slot in interval_slots(order.delivery_intervals):
+                bucket = buckets[order.region_id, slot]
+                del bucket[bisect_left(bucket, (order.weight, order.id))]
+
+        if chosen:
+            matches[courier] = chosen
+
+    return matches
+
+
+def push_heaviest(heap, bucket, key, end, free):
+    """ Добавить в кучу самый тяжелый заказ корзины из bucket[:end] весом не больше free """
+
+    position = min(end, bisect_right(bucket, (free, inf))) - 1
+
+    if position >= 0:
+        weight, order_id = bucket[position]
+        heappush(heap, (-weight, order_id, key, position))
+
+
+def dispatch_orders():
+    """Выдача всех свободных заказов всем курьерам
+
+    На PostgreSQL свободные заказы блокируются SELECT ... FOR UPDATE SKIP LOCKED,
+    заказы, которые в это время забирает assign, пропускаются. На SQLite
+    заказы забираются условным UPDATE, как в assign, а при OPEN_ORDER_INDEX
+    свободные заказы берутся из индекса в памяти. Выдачи всем курьерам
+    записываются несколькими UPDATE (claim_matches). Строки курьеров
+    блокируются, как в assign, поэтому вместе с ним грузоподъемность
+    не превышается.
+
+    Returns:
+        dict: {курьер: (выданные заказы, время выдачи)}
+    """
+
+    locked = connection.features.has_select_for_update_skip_locked
+
+    indexed = getattr(settings, 'OPEN_ORDER_INDEX', False) and not locked
+
+    with transaction.atomic():
+        # Курьеры блокируются до чтения загрузки, как в Courier.assign_orders:
+        # курьеры, которым сейчас выдает заказы assign, пропускаются
+        couriers = Courier.objects.prefetch_related('regions')
+
+        if locked:
+            couriers = couriers.select_for_update(skip_locked=True)
+        else:
+            # В SQLite нет SKIP LOCKED: запись берет блокировку всей базы,
+            # assign ждет окончания распределения
+            Courier.objects.update(id=F('id'))
+
+        couriers = list(couriers)
+
+        if indexed:
+            orders = open_orders.snapshot()
+        else:
+            orders = Order.objects.filter(assign_time__isnull=True).only(
+                'id', 'weight', 'region', 'delivery_hours')
+
+        if locked:
+            orders = orders.select_for_update(skip_locked=True)
+
+        loads = dict(Order.objects
+                        .filter(courier__isnull=False, complete_time__isnull=True)
+                        .values_list('courier')
+                        .annotate(load=Sum('weight')))
+
+        matches = match_orders(couriers, list(orders), loads)
+
+        return claim_matches(matches, locked, indexed)
+
+
+def claim_matches(matches, locked=False, indexed=False):
+    """Запись выдачи подобранных заказов всем курьерам сразу
+
+    Вместо UPDATE на каждого курьера (Courier.claim_orders) заказы
+    обновляются пачками через CASE по id. Без блокировки (SQLite) обновляются
+    только все еще свободные заказы, выданные затем перечитываются.
+
+    Args:
+        matches (dict): {курьер: [выбранные заказы]}
+        locked (bool): строки заказов уже заблокированы в текущей транзакции
+        indexed (bool): заказы взяты из индекса свободных заказов
+
+    Returns:
+        dict: {курьер: (выданные заказы, время выдачи)}
+    """
+
+    couriers = {order.id: courier for courier, chosen in matches.items() for order in chosen}
+
+    if not couriers:
+        return {}
+
+    assign_time = timezone.now()
+    queryset = Order.objects.all() if locked else Order.objects.filter(assign_time__isnull=True)
+
+    with transaction.atomic(savepoint=False):
+        updated = update_cases_by_ids(
+            queryset,
+            {
+                order_id: {'courier': courier.id, 'completed_courier_type': courier.courier_type}
+                for order_id, courier in couriers.items()
+            },
+            assign_time=assign_time)
+
+        claimed = set(couriers)
+
+        if updated != len(couriers):
+            claimed = {
+                order.id for order in objects_by_ids(
+                    Order.objects.filter(assign_time=assign_time).only('id', 'courier'), couriers)
+                if order.courier_id == couriers[order.id].id
+            }
+
+        OrderChange.record(sorted(claimed))
+
+    if indexed:
+        transaction.on_commit(lambda: open_orders.forget(couriers))
+
+    result = {}
+
+    for courier, chosen in matches.items():
+        chosen = [order for order in chosen if order.id in claimed]
+
+        for order in chosen:
+            order.assign(courier, assign_time)
+
+        if chosen:
+            result[courier] = (chosen, assign_time)
+
+    return result
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from couriers.models import StatsUpdateJob
+
+
+class Command(BaseCommand):
+    help = ('Обработчик очереди пересчета статистики курьеров '
+            '(используется при STATS_UPDATE_MODE = "queue")')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='обработать текущую очередь и завершиться')
+        parser.add_argument('--batch', type=int, default=100,
+                            help='число задач, выбираемых за один раз')
+        parser.add_argument('--interval', type=float, default=1,
+                            help='пауза в секундах, когда очередь пуста')
+
+    def handle(self, *args, **options):
+        total = 0
+
+        while True:
+            processed = StatsUpdateJob.process(options['batch'])
+            total += processed
+
+            if processed:
+                continue
+
+            if options['once']:
+                break
+
+            time.sleep(options['interval'])
+
+        self.stdout.write('Пересчитана статистика %d курьеров' % total)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from couriers.models import Courier
+
+
+class Command(BaseCommand):
+    help = 'Пересчет рейтинга, заработка и накопленных сумм курьеров по истории заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('courier_ids', nargs='*', type=int,
+                            help='id курьеров, по умолчанию - все курьеры')
+
+    def handle(self, *args, **options):
+        couriers = Courier.objects.order_by('id')
+
+        if options['courier_ids']:
+            couriers = couriers.filter(id__in=options['courier_ids'])
+
+        count = 0
+
+        for courier in couriers.iterator():
+            courier.rebuild_stats()
+            count += 1
+
+        self.stdout.write('Обновлена статистика %d курьеров' % count)
@@ -0,0 +1,159 @@
+"""Векторизованная проверка, какие свободные заказы может взять курьер
+
+Необязательный движок на NumPy: свободные заказы загружаются в столбцы
+(вес, район, начало и конец каждого промежутка доставки в минутах), и
+маска подходящих заказов считается векторными сравнениями. Правила те же,
+что в Courier.can_assign_order, результат совпадает со скалярной проверкой.
+
+Движок включается настройкой MATCHING_ENGINE = 'numpy', тогда его
+используют assign (assignable_orders) и dispatch (match_orders).
+Если NumPy не установлен, OrderColumns бросает ImproperlyConfigured,
+по умолчанию ('python') заказы проверяются через can_assign_order.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from orders.intervals import parse_hours
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class OrderColumns:
+    """Свободные заказы в виде столбцов NumPy
+
+    Заказы сгруппированы по районам, поэтому проверка курьера затрагивает
+    только заказы его районов.
+
+    Args:
+        ids, weights, regions: id, вес и район каждого заказа
+        intervals (list[tuple[tuple[int, int]]]): промежутки доставки каждого заказа
+    """
+
+    def __init__(self, ids, weights, regions, intervals):
+        if np is None:
+            raise ImproperlyConfigured('Для векторизованной проверки нужен пакет numpy')
+
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        regions = np.asarray(regions, dtype=np.int64)
+
+        counts = np.fromiter((len(i) for i in intervals), dtype=np.int64, count=len(intervals))
+        interval_order = np.repeat(np.arange(len(self.ids)), counts)
+        bounds = np.fromiter(
+            (minute for order_intervals in intervals
+                    for interval in order_intervals
+                    for minute in interval),
+            dtype=np.int32,
+            count=2 * int(counts.sum())).reshape(-1, 2)
+
+        # Промежутки сортируются по району заказа, у каждого района свой срез
+        interval_regions = regions[interval_order]
+        order = np.argsort(interval_regions, kind='stable')
+
+        self.interval_order = interval_order[order]
+        self.interval_start = bounds[order, 0]
+        self.interval_end = bounds[order, 1]
+
+        region_ids, starts, region_counts = np.unique(
+            interval_regions[order], return_index=True, return_counts=True)
+
+        self.region_slices = {
+            int(region_id): slice(int(start), int(start + count))
+            for region_id, start, count in zip(region_ids, starts, region_counts)
+        }
+
+    @classmethod
+    def from_orders(cls, orders):
+        """ Столбцы по загруженным заказам """
+
+        return cls(
+            [o.id for o in orders],
+            [o.weight for o in orders],
+            [o.region_id for o in orders],
+            [o.delivery_intervals for o in orders])
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """ Столбцы по заказам из queryset """
+
+        rows = list(queryset.values_list('id', 'weight', 'region_id', 'delivery_hours'))
+
+        return cls(
+            [r[0] for r in rows],
+            [r[1] for r in rows],
+            [r[2] for r in rows],
+            [parse_hours(r[3]) for r in rows])
+
+    def eligible_mask(self, courier):
+        """Маска заказов, которые может взять курьер
+
+        Args:
+            courier (Courier): курьер
+
+        Returns:
+            numpy.ndarray: bool-маска по заказам в порядке ids
+        """
+
+        slices = [self.region_slices[r] for r in courier.region_ids if r in self.region_slices]
+        mask = np.zeros(len(self.ids), dtype=bool)
+
+        if not slices or not courier.working_intervals:
+            return mask
+
+        interval_order = np.concatenate([self.interval_order[s] for s in slices])
+        interval_start = np.concatenate([self.interval_start[s] for s in slices])
+        interval_end = np.concatenate([self.interval_end[s] for s in slices])
+
+        fits = np.zeros(len(interval_order), dtype=bool)
+
+        for start, end in courier.working_intervals:
+            fits |= (interval_start < end) & (interval_end > start)
+
+        fits &= self.weights[interval_order] <= float(courier.lifting_capacity)
+        mask[interval_order[fits]] = True
+
+        return mask
+
+    def eligible_ids(self, courier):
+        """ id заказов, которые может взять курьер, по возрастанию """
+
+        return np.sort(self.ids[self.eligible_mask(courier)])
+
+    def eligible_by_courier(self, couriers):
+        """ {id курьера: id подходящих заказов} для нескольких курьеров """
+
+        return {courier.id: self.eligible_ids(courier) for courier in couriers}
+
+
+def use_numpy():
+    """ Выбран ли движок NumPy в настройке MATCHING_ENGINE """
+
+    engine = getattr(settings, 'MATCHING_ENGINE', 'python')
+
+    if engine not in ('python', 'numpy'):
+        raise ImproperlyConfigured('MATCHING_ENGINE: ожидается python или numpy, а не %r' % engine)
+
+    return engine == 'numpy'
+
+
+def assignable_orders(courier, orders):
+    """Заказы, которые может взять курьер, проверенные выбранным движком
+
+    Args:
+        courier (Courier): курьер
+        orders (list[Order]): свободные заказы
+
+    Returns:
+        list[Order]: подходящие заказы в исходном порядке
+    """
+
+    if not (orders and use_numpy()):
+        return [order for order in orders if courier.can_assign_order(order)]
+
+    eligible = set(OrderColumns.from_orders(orders).eligible_ids(courier).tolist())
+
+    return [order for order in orders if order.id in eligible]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.7 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('couriers', '0004_auto_20210328_1150'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='last_complete_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='courier',
+            name='region_stats',
+            field=models.JSONField(default=dict),
+        ),
+    ]
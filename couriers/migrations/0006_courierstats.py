@@ -0,0 +1,32 @@
+# Generated by Django 3.1.7 on 2026-10-18 07:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_delivery_bounds'),
+        ('couriers', '0005_courier_region_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourierStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'день'), ('week', 'неделя')], max_length=4)),
+                ('period_start', models.DateField()),
+                ('orders_count', models.IntegerField(default=0)),
+                ('delivery_seconds', models.FloatField(default=0)),
+                ('earnings', models.IntegerField(default=0)),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='couriers.courier')),
+                ('region', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='orders.region')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='courierstats',
+            constraint=models.UniqueConstraint(fields=('courier', 'period', 'period_start', 'region'), name='courier_stats_unique_period'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.7 on 2026-10-18 07:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('couriers', '0006_courierstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsUpdateJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('courier', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats_job', to='couriers.courier')),
+            ],
+        ),
+    ]
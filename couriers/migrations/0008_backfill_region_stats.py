@@ -0,0 +1,58 @@
+from django.db import migrations
+
+
+def backfill_region_stats(apps, schema_editor):
+    """Суммы времени доставки по районам для курьеров, завершивших заказы до 0005
+
+    Считается так же, как Courier.add_delivery: первый заказ - от выдачи
+    до завершения, остальные - от завершения предыдущего до выдачи.
+    """
+
+    Courier = apps.get_model('couriers', 'Courier')
+    Order = apps.get_model('orders', 'Order')
+    db = schema_editor.connection.alias
+
+    couriers = {}
+
+    orders = (Order.objects.using(db)
+                .filter(courier__isnull=False, complete_time__isnull=False,
+                        courier__last_complete_time__isnull=True)
+                .order_by('courier_id', 'complete_time', 'id')
+                .values_list('courier_id', 'region_id', 'assign_time', 'complete_time')
+                .iterator())
+
+    for courier_id, region_id, assign_time, complete_time in orders:
+        region_stats, last_complete_time = couriers.get(courier_id, ({}, None))
+
+        if last_complete_time is None:
+            delivery_time = (complete_time - assign_time).total_seconds()
+        else:
+            delivery_time = (assign_time - last_complete_time).total_seconds()
+
+        totals = region_stats.setdefault(str(region_id), [0, 0])
+        totals[0] += delivery_time
+        totals[1] += 1
+
+        couriers[courier_id] = (region_stats, complete_time)
+
+    ids = list(couriers)
+
+    for i in range(0, len(ids), 500):
+        updated = list(Courier.objects.using(db).filter(id__in=ids[i:i + 500]))
+
+        for courier in updated:
+            courier.region_stats, courier.last_complete_time = couriers[courier.id]
+
+        Courier.objects.using(db).bulk_update(updated, ['region_stats', 'last_complete_time'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_delivery_bounds'),
+        ('couriers', '0007_statsupdatejob'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_region_stats, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,46 @@
+import logging
 import datetime
-from collections import defaultdict, namedtuple
 
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.db.models import Case, F, Q, Sum, Value, When
 
-from orders.models import Region, Order
+from orders.bulk import existing_values, is_integer, problem_key, update_by_ids
+from orders.intervals import ParsedHours, parse_hours, intervals_overlap
+from orders.models import Region, Order, OrderChange
+from orders.index import open_orders
+from couriers import cache as courier_cache
+from couriers.matching import assignable_orders
+from couriers.packing import pack_orders
+from couriers.rating import region_delivery_stats
+
+
+logger = logging.getLogger(__name__)
+
+
+def rating_by_regions(region_sums):
+    """Рейтинг по суммам времени доставки по районам
+
+    rating = (60*60 - min(t, 60*60))/(60*60) * 5,
+    где t - минимальное из средних времен доставки по районам (в секундах)
+
+    Args:
+        region_sums (iterable): пары [сумма времени доставки, число заказов]
+
+    Returns:
+        float: рейтинг, 0 если заказов нет
+    """
+
+    averages = [total / count for total, count in region_sums if count]
+
+    if not averages:
+        return 0
+
+    min_t = min(averages)
+
+    return round((60 * 60 - min(min_t, 60 * 60)) / (60*60) * 5, 2)
 
 
 class Courier(models.Model):
@@ -33,6 +70,14 @@ class Courier(models.Model):
     rating = models.DecimalField(max_digits=6, decimal_places=2, default=0)
     earnings = models.IntegerField(default=0)
 
+    # Накопленные суммы для рейтинга: {id района: [сумма времени доставки, число заказов]}
+    region_stats = models.JSONField(default=dict)
+    last_complete_time = models.DateTimeField(blank=True, null=True)
+
+    STATS_FIELDS = ['rating', 'earnings', 'region_stats', 'last_complete_time']
+
+    working_intervals = ParsedHours('working_hours')
+
     VALIDATION_ERRORS = {
         1: 'Не задано значение',
         2: 'Не соответствует формату',
@@ -42,6 +87,17 @@ class Courier(models.Model):
     def __str__(self):
         return "courier %s" % self.id
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        courier_cache.invalidate(self.id)
+
+    def delete(self, *args, **kwargs):
+        courier_id = self.id
+        result = super().delete(*args, **kwargs)
+        courier_cache.invalidate(courier_id)
+
+        return result
+
     @property
     def courier_id(self):
         return self.id
@@ -62,42 +118,79 @@ class Courier(models.Model):
     def get_regions(self):
         return [r.id for r in self.regions.all()]
 
+    @cached_property
+    def region_ids(self):
+        """ id регионов курьера, запрашиваются один раз на экземпляр
+
+        Сбрасывается в set_regions
+        """
+
+        return frozenset(r.id for r in self.regions.all())
+
     @property
     def working_hours_list(self):
         return self.working_hours.split(';')
 
     def set_rating(self):
-        """ Расчет рейтинга, будет вызываться каждый раз, 
-        когда потребуется информация о курьере
+        """ Расчет рейтинга по всей истории заказов курьера
 
         rating = (60*60 - min(t, 60*60))/(60*60) * 5 
         где  t  - минимальное из средних времен доставки по районам (в секундах),
         t = min(td[1], td[2], ..., td[n]) 
         td[i]  - среднее время доставки заказов по району  i  (в секундах).
+
+        Заодно заново заполняет накопленные суммы по районам,
+        после каждого заказа они обновляются в order_completed.
+        Суммы считаются одним запросом, см. couriers.rating
         """
 
-        orders = self.get_completed_orders()
-        regions = defaultdict(lambda: [0, 0])
+        stats = region_delivery_stats([self.id])
+        self.region_stats, self.last_complete_time = stats.get(self.id, ({}, None))
 
-        prev_delivery_time = None
+        self.rating = self.calculate_rating()
 
-        for order in orders:
-            if not prev_delivery_time:
-                delivery_time = order.delivery_time_in_seconds
-            else:
-                delivery_time = (order.assign_time - prev_delivery_time).total_seconds()
+    def add_delivery(self, order):
+        """ Добавление времени доставки заказа в суммы по районам
 
-            region_id = order.get_region().id
+        Args:
+            order (Order): завершенный заказ
 
-            regions[region_id][0] += delivery_time
-            regions[region_id][1] += 1
-            
-            prev_delivery_time = order.complete_time
+        Returns:
+            float: время доставки заказа в секундах
+        """
 
-        min_t = min(map(lambda x: x[0] / x[1], regions.values()))
+        delivery_time = Courier.get_delivery_time(order, self.last_complete_time)
+
+        region_stats = self.region_stats.setdefault(str(order.region_id), [0, 0])
+        region_stats[0] += delivery_time
+        region_stats[1] += 1
+
+        self.last_complete_time = order.complete_time
+
+        return delivery_time
+
+    @staticmethod
+    def get_delivery_time(order, last_complete_time):
+        """ Время доставки заказа в секундах для рейтинга
+
+        Для первого заказа - от выдачи до завершения,
+        для остальных - от завершения предыдущего заказа до выдачи этого.
+
+        Args:
+            order (Order): завершенный заказ
+            last_complete_time (datetime): время завершения предыдущего заказа
+        """
+
+        if not last_complete_time:
+            return order.delivery_time_in_seconds
+
+        return (order.assign_time - last_complete_time).total_seconds()
+
+    def calculate_rating(self):
+        """ Рейтинг по накопленным суммам времени доставки по районам """
+
+        return rating_by_regions(self.region_stats.values())
 
-        self.rating = round((60 * 60 - min(min_t, 60 * 60)) / (60*60) * 5, 2)
-        
     def set_earning(self):
         """Заработок рассчитывается как сумма оплаты за каждый завершенный развоз:
         sum = ∑(500 * C),
@@ -106,35 +199,184 @@ class Courier(models.Model):
         на момент формирования развоза.
         """ 
 
-        orders = self.get_completed_orders()
-        self.earnings = sum([Courier.get_earning_coef(o.completed_courier_type) * 500 
-                             for o in orders])
+        payment = Case(
+            *[When(completed_courier_type=courier_type, then=Value(coef * 500))
+              for courier_type, coef in Courier.COEF_BY_TYPE.items()],
+            default=Value(0),
+            output_field=models.IntegerField())
+
+        self.earnings = (self.get_completed_orders()
+                            .order_by()
+                            .aggregate(earnings=Sum(payment))['earnings']) or 0
 
     def get_completed_orders(self):
-        """ Завершенные курьеров заказы """
+        """ Завершенные курьеров заказы в порядке завершения """
         return (Order.objects
-                    .filter(courier=self, complete_time__isnull=False))
+                    .filter(courier=self, complete_time__isnull=False)
+                    .order_by('complete_time', 'id'))
+
+    def get_active_orders(self):
+        """ Выданные курьеру, но еще не доставленные заказы """
+        return Order.objects.filter(courier=self, complete_time__isnull=True)
 
     def is_handy_time(self, time):
         """ Удобно ли курьеру взять заказ в это время
         str: time - время формата %H:%M-%H:%M
 
-        Будем считать, что курьеру удобно, если начало или конец промежутка
-        лежит хотя-бы в одном рабочем времени курьера.
+        Будем считать, что курьеру удобно, если промежуток доставки
+        пересекается хотя-бы с одним рабочим временем курьера.
+        """
+
+        return intervals_overlap(self.working_intervals, parse_hours(time))
+
+    def get_load(self):
+        """ Суммарный вес выданных, но еще не доставленных заказов """
+
+        return self.get_active_orders().aggregate(load=Sum('weight'))['load'] or 0
+
+    def get_candidate_orders(self, capacity=None):
+        """ Свободные заказы, которые курьер может забрать
+
+        Вес, регион и время доставки проверяются на стороне базы данных
+        (частичный индекс order_open_region_idx). Время сравнивается по границам
+        всех промежутков доставки заказа, поэтому точная проверка
+        остается за can_assign_order.
+
+        Args:
+            capacity (Decimal): свободная грузоподъемность,
+                по умолчанию - полная грузоподъемность курьера
+
+        Returns:
+            QuerySet: заказы-кандидаты
+        """
+
+        if capacity is None:
+            capacity = self.lifting_capacity
+
+        hours = Q()
+
+        for start, end in self.working_intervals:
+            hours |= Q(delivery_start__lt=end, delivery_end__gt=start)
+
+        if not hours:
+            return Order.objects.none()
+
+        return (Order.objects
+                    .filter(hours,
+                            assign_time__isnull=True,
+                            region__in=self.regions.all(),
+                            weight__lte=capacity)
+                    .order_by('id'))
+
+    def assign_orders(self):
+        """Выдача курьеру подходящих свободных заказов
+
+        На PostgreSQL кандидаты блокируются SELECT ... FOR UPDATE SKIP LOCKED:
+        заказы, которые в этот момент забирает другой процесс, пропускаются
+        без ожидания. Если база не поддерживает SKIP LOCKED (SQLite), заказ
+        забирается условным UPDATE ... WHERE assign_time IS NULL, и курьеру
+        достаются только те заказы, которые изменил именно этот UPDATE.
+
+        При OPEN_ORDER_INDEX кандидаты берутся из индекса свободных заказов
+        в памяти процесса (orders.index). Индекс только подсказывает id,
+        заказы забираются так же, как без него.
+
+        Суммарный вес новых и еще не доставленных заказов не превышает
+        грузоподъемность курьера, заказы подбираются через pack_orders.
+        Строка курьера блокируется (lock), поэтому одновременные выдачи
+        одному курьеру не превышают грузоподъемность вместе.
+
+        Returns:
+            list[Order]: выданные заказы
+            datetime: время выдачи, None если заказов нет
         """
 
-        def t_d(time):
-            return datetime.datetime.strptime(time, '%H:%M')
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        indexed = getattr(settings, 'OPEN_ORDER_INDEX', False)
+
+        with transaction.atomic():
+            # Выдачи одному курьеру идут по очереди, загрузка читается после них
+            self.lock()
+            capacity = self.lifting_capacity - self.get_load()
 
-        start_time, end_time = time.split('-')
+            if indexed:
+                candidates = open_orders.candidates(self.region_ids, self.working_intervals, capacity)
+
+                if skip_locked:
+                    locked_ids = existing_values(
+                        Order.objects.filter(assign_time__isnull=True).select_for_update(skip_locked=True),
+                        [order.id for order in candidates])
+                    candidates = [order for order in candidates if order.id in locked_ids]
+            else:
+                candidates = self.get_candidate_orders(capacity)
+
+                if skip_locked:
+                    candidates = candidates.select_for_update(skip_locked=True)
+
+            chosen = pack_orders(assignable_orders(self, list(candidates)), capacity)
+
+            if indexed:
+                # Заказы, забранные другим процессом, из индекса тоже убираются,
+                # но только после коммита: при откате они остаются свободными
+                chosen_ids = [order.id for order in chosen]
+                transaction.on_commit(lambda: open_orders.forget(chosen_ids))
+
+            return self.claim_orders(chosen, locked=skip_locked)
+
+    def lock(self):
+        """Блокировка строки курьера до конца текущей транзакции
+
+        На PostgreSQL - SELECT ... FOR UPDATE. SQLite его не поддерживает,
+        там пустой UPDATE берет блокировку записи, и транзакции,
+        которые тоже пишут, ждут ее завершения.
+        """
 
-        for working_hour in self.working_hours_list:
-            w_start_time, w_end_time = working_hour.split('-')
+        couriers = Courier.objects.filter(id=self.id)
 
-            if t_d(w_end_time) > t_d(start_time) or t_d(end_time) > t_d(w_start_time):
-                return True
+        if connection.features.has_select_for_update:
+            list(couriers.select_for_update().values_list('id', flat=True))
+        else:
+            couriers.update(id=F('id'))
 
-        return False
+    def claim_orders(self, orders, locked=False):
+        """Запись выдачи заказов курьеру
+
+        Args:
+            orders (list[Order]): свободные заказы
+            locked (bool): строки заказов уже заблокированы в текущей транзакции
+
+        Returns:
+            list[Order]: выданные заказы
+            datetime: время выдачи, None если заказов нет
+        """
+
+        if not orders:
+            return [], None
+
+        assign_time = timezone.now()
+        queryset = Order.objects.all() if locked else Order.objects.filter(assign_time__isnull=True)
+
+        # Без точки сохранения: при ошибке откатывается вся внешняя транзакция
+        with transaction.atomic(savepoint=False):
+            updated = update_by_ids(
+                queryset,
+                [o.id for o in orders],
+                courier=self,
+                assign_time=assign_time,
+                completed_courier_type=self.courier_type)
+
+            if updated != len(orders):
+                claimed = set(Order.objects
+                                .filter(courier=self, assign_time=assign_time)
+                                .values_list('id', flat=True))
+                orders = [o for o in orders if o.id in claimed]
+
+            OrderChange.record([o.id for o in orders])
+
+        for order in orders:
+            order.assign(self, assign_time)
+
+        return orders, (assign_time if orders else None)
 
     def can_assign_order(self, order):
         """Может ли курьер забрать заказ 
@@ -149,8 +391,8 @@ class Courier(models.Model):
 
         return (
             order.weight <= self.lifting_capacity and
-            order.region.id in [r.id for r in self.regions.all()] and
-            any([self.is_handy_time(time) for time in order.delivery_hours_list])
+            order.region_id in self.region_ids and
+            intervals_overlap(self.working_intervals, order.delivery_intervals)
         )
 
     def to_json(self, fields=None):
@@ -195,57 +437,136 @@ class Courier(models.Model):
 
         Returns:
             dict: ошибки, если не прошло валидацию
-            Courier: не сохраненный объект курьера
+            Courier: сохраненный объект курьера
+        """
+
+        couriers, problems = Courier.bulk_from_json([data])
+
+        if problems:
+            return next(iter(problems.values()))
+
+        return couriers[0]
+
+    @staticmethod
+    def bulk_from_json(data_list):
+        """Создание курьеров из списка json одним пакетом
+
+        Идентификаторы и регионы всех курьеров проверяются несколькими
+        запросами IN, курьеры и их регионы сохраняются через bulk_create
+        в одной транзакции. Если хотя-бы один курьер не прошел валидацию,
+        ничего не сохраняется.
+
+        Args:
+            data_list (list[dict]): описания курьеров в формате json
+
+        Returns:
+            list[Courier]: сохраненные курьеры
+            dict: ошибки по id курьеров, не прошедших валидацию
         """
 
+        taken_ids = existing_values(
+            Courier.objects.all(),
+            [d['courier_id'] for d in data_list if is_integer(d.get('courier_id'))])
+
+        region_ids = existing_values(
+            Region.objects.all(),
+            [r for d in data_list if isinstance(d.get('regions'), list)
+               for r in d['regions'] if is_integer(r)])
+
+        couriers = []
+        courier_regions = []
         problems = {}
-        fields = ['courier_id', 'courier_type', 'working_hours']
 
-        courier = Courier()
+        for position, data in enumerate(data_list):
+            courier = Courier()
+            errors = courier.validate_json(data, taken_ids, region_ids)
+
+            if errors:
+                problems[problem_key(data, 'courier_id', position)] = errors
+                continue
+
+            courier.region_ids = frozenset(data['regions'])
+            couriers.append(courier)
+            courier_regions.extend(
+                Courier.regions.through(courier_id=courier.id, region_id=region_id)
+                for region_id in dict.fromkeys(data['regions']))
+
+        if problems:
+            return [], problems
+
+        with transaction.atomic():
+            Courier.objects.bulk_create(couriers)
+            Courier.regions.through.objects.bulk_create(courier_regions)
+            courier_cache.invalidate(*[c.id for c in couriers])
+
+        return couriers, problems
+
+    def validate_json(self, data, taken_ids, region_ids):
+        """Заполнение полей из json без запросов к базе данных
+
+        Args:
+            data (dict): описание объекта в формате json
+            taken_ids (set[int]): занятые id, id курьера добавляется к ним
+            region_ids (set[int]): существующие id регионов
+
+        Returns:
+            dict: ошибки, пустой, если валидация пройдена
+        """
+
+        problems = {}
+        fields = ['courier_id', 'courier_type', 'working_hours']
 
         for field in fields:
             if not field in data:
                 problems[field] = {
                     'code': 1,
-                    'description': courier.VALIDATION_ERRORS[1]
+                    'description': self.VALIDATION_ERRORS[1]
                 }
 
         if problems:
             return problems
 
-        methods = courier.get_setters_by_field(fields).values()
-
-        for method, field in zip(methods, fields):
-            c = method(data[field])
+        courier_id = data['courier_id']
+
+        if not is_integer(courier_id):
+            code = 2
+        elif courier_id in taken_ids:
+            code = 3
+        else:
+            code = 0
+            self.id = courier_id
+            taken_ids.add(courier_id)
+
+        codes = {
+            'courier_id': code,
+            'courier_type': self.set_courier_type(data['courier_type']),
+            'working_hours': self.set_working_hours(data['working_hours']),
+        }
 
+        for field, c in codes.items():
             if c != 0:
                 problems[field] = {
                     'code': c,
-                    'description': courier.VALIDATION_ERRORS[c]
+                    'description': self.VALIDATION_ERRORS[c]
                 }
 
         if problems:
             return problems
 
-        courier.save()
+        regions = data.get('regions')
 
-        if not data.get('regions'):
+        if not regions:
             problems['regions'] = {
                 'code': 1,
-                'description': courier.VALIDATION_ERRORS[1]
+                'description': self.VALIDATION_ERRORS[1]
             }
-            return problems
-
-        if courier.set_regions(data.get('regions')) != 0:
+        elif not isinstance(regions, list) or not all(is_integer(r) and r in region_ids for r in regions):
             problems['regions'] = {
                 'code': 3,
-                'description': courier.VALIDATION_ERRORS[3]
+                'description': self.VALIDATION_ERRORS[3]
             }
-            return problems
 
-        courier.save()
-
-        return courier
+        return problems
 
     def patch(self, params):
         """Внесение изменений в объекте
@@ -267,34 +588,88 @@ class Courier(models.Model):
 
         field_setters = self.get_setters_by_field(params.keys())
 
-        for field, value in params.items():
-            c = field_setters[field](value)
+        with transaction.atomic():
+            for field, value in params.items():
+                c = field_setters[field](value)
 
-            if c != 0:
-                problems[field] = {
-                    'code': c,
-                    'description': self.VALIDATION_ERRORS[c]
-                }
+                if c != 0:
+                    problems[field] = {
+                        'code': c,
+                        'description': self.VALIDATION_ERRORS[c]
+                    }
 
-        if problems:
-            return problems
+            if problems:
+                transaction.set_rollback(True)
+                self.__dict__.pop('region_ids', None)
+                return problems
+
+            active = list(self.get_active_orders())
+            kept = pack_orders(
+                [order for order in active if self.can_assign_order(order)],
+                self.lifting_capacity)
 
-        for order in Order.objects.filter(courier=self, complete_time__isnull=True):
-            if not self.can_assign_order(order):
-                order.courier = None
-                order.assign_time = None
-                order.save()
+            kept_ids = {order.id for order in kept}
+            released = [order.id for order in active if order.id not in kept_ids]
 
-        self.save()
+            update_by_ids(Order.objects.all(), released, courier=None, assign_time=None)
+            OrderChange.record(released)
+
+            self.save()
 
         return self
 
-    def order_completed(self):
-        """ Закончил заказ. Обновляем статистику """
-        
-        self.set_earning()
-        self.set_rating()
-        self.save()
+    def order_completed(self, order):
+        """Закончил заказ. Обновляем статистику
+
+        К накопленным суммам добавляется только этот заказ,
+        поэтому время не зависит от длины истории курьера.
+        Если заказ завершен не позже предыдущего, суммы считаются
+        в порядке complete_time, как в rebuild_stats, по всей истории.
+        При STATS_UPDATE_MODE = 'queue' статистика не считается сразу,
+        а ставится задача на пересчет (см. StatsUpdateJob).
+
+        Args:
+            order (Order): только что завершенный заказ
+        """
+
+        if getattr(settings, 'STATS_UPDATE_MODE', 'sync') == 'queue':
+            StatsUpdateJob.enqueue(self)
+            return
+
+        with transaction.atomic():
+            stats = (Courier.objects
+                        .select_for_update()
+                        .values(*self.STATS_FIELDS)
+                        .get(id=self.id))
+
+            for field, value in stats.items():
+                setattr(self, field, value)
+
+            if self.last_complete_time and order.complete_time <= self.last_complete_time:
+                # Заказ встает в середину истории: меняется время доставки
+                # следующего за ним заказа, инкрементально это не посчитать
+                self.rebuild_stats()
+                return
+
+            delivery_time = self.add_delivery(order)
+            earning = Courier.get_earning_coef(order.completed_courier_type) * 500
+
+            self.earnings += earning
+            self.rating = self.calculate_rating()
+
+            self.save(update_fields=self.STATS_FIELDS)
+
+            CourierStats.add_order(self, order, delivery_time, earning)
+
+    def rebuild_stats(self):
+        """ Пересчет рейтинга, заработка и накопленных сумм по всей истории """
+
+        with transaction.atomic():
+            self.set_earning()
+            self.set_rating()
+            self.save(update_fields=self.STATS_FIELDS)
+
+            CourierStats.rebuild(self)
 
     def get_setters_by_field(self, fields):
         """Получение словаря сеттеров, по названиям атрибутов
@@ -343,7 +718,7 @@ class Courier(models.Model):
             <int:id>, если вызвалась ошибка
         """
 
-        if courier_type in dict(self.COURIER_TYPES):
+        if isinstance(courier_type, str) and courier_type in dict(self.COURIER_TYPES):
             self.courier_type = courier_type
             return 0
 
@@ -359,15 +734,18 @@ class Courier(models.Model):
             0, если корректно
             <int:id>, если вызвалась ошибка
         """
-        self.regions.clear()
+        if not isinstance(regions, list) or not all(is_integer(r) for r in regions):
+            return 3
+
+        region_ids = existing_values(Region.objects.all(), regions)
+
+        if len(region_ids) != len(set(regions)):
+            return 3
+
+        self.regions.set(region_ids)
+        self.region_ids = frozenset(region_ids)
+        courier_cache.invalidate(self.id)
 
-        for region_id in regions:
-            if Region.objects.filter(id=region_id).first():
-                region = Region.objects.get(id=region_id)
-                self.regions.add(region)
-            else:
-                return 1
-                
         return 0
 
     def set_working_hours(self, working_hours):
@@ -381,5 +759,217 @@ class Courier(models.Model):
             <int:id>, если вызвалась ошибка
         """
 
-        self.working_hours = ';'.join(working_hours)
-        return 0
\ No newline at end of file
+        if not isinstance(working_hours, list) or not all(isinstance(h, str) for h in working_hours):
+            return 2
+
+        try:
+            Courier.working_intervals.set(self, ';'.join(working_hours))
+        except ValueError:
+            return 2
+
+        return 0
+
+
+class CourierStats(models.Model):
+    """Статистика курьера за день или неделю по району
+
+    Обновляется в той же транзакции, что и завершение заказа,
+    поэтому рейтинг и заработок за период читаются одним запросом
+    по индексу (courier, period, period_start) без обхода истории заказов.
+    """
+
+    PERIODS = (
+        ('day', 'день'),
+        ('week', 'неделя'),
+    )
+
+    courier = models.ForeignKey(Courier, on_delete=models.CASCADE, related_name='stats')
+    period = models.CharField(max_length=4, choices=PERIODS)
+    period_start = models.DateField()
+    region = models.ForeignKey(Region, on_delete=models.CASCADE)
+
+    orders_count = models.IntegerField(default=0)
+    delivery_seconds = models.FloatField(default=0)
+    earnings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['courier', 'period', 'period_start', 'region'],
+                name='courier_stats_unique_period'),
+        ]
+
+    def __str__(self):
+        return "stats %s %s %s" % (self.courier_id, self.period, self.period_start)
+
+    @staticmethod
+    def get_period_starts(moment):
+        """Начала периодов, в которые попадает момент времени
+
+        Returns:
+            dict: {период: дата начала}
+        """
+
+        day = timezone.localtime(moment).date()
+
+        return {
+            'day': day,
+            'week': day - datetime.timedelta(days=day.weekday()),
+        }
+
+    @staticmethod
+    def add_order(courier, order, delivery_time, earning):
+        """Добавление завершенного заказа в статистику за день и неделю
+
+        Args:
+            courier (Courier): курьер
+            order (Order): завершенный заказ
+            delivery_time (float): время доставки для рейтинга, в секундах
+            earning (int): оплата за заказ
+        """
+
+        for period, period_start in CourierStats.get_period_starts(order.complete_time).items():
+            key = {
+                'courier': courier,
+                'period': period,
+                'period_start': period_start,
+                'region_id': order.region_id,
+            }
+            changes = {
+                'orders_count': F('orders_count') + 1,
+                'delivery_seconds': F('delivery_seconds') + delivery_time,
+                'earnings': F('earnings') + earning,
+            }
+
+            if CourierStats.objects.filter(**key).update(**changes):
+                continue
+
+            try:
+                with transaction.atomic():
+                    CourierStats.objects.create(
+                        orders_count=1,
+                        delivery_seconds=delivery_time,
+                        earnings=earning,
+                        **key)
+            except IntegrityError:
+                CourierStats.objects.filter(**key).update(**changes)
+
+    @staticmethod
+    def rebuild(courier):
+        """ Пересчет статистики курьера по всей истории заказов """
+
+        stats = {}
+        last_complete_time = None
+
+        for order in courier.get_completed_orders():
+            delivery_time = Courier.get_delivery_time(order, last_complete_time)
+            earning = Courier.get_earning_coef(order.completed_courier_type) * 500
+            last_complete_time = order.complete_time
+
+            for period, period_start in CourierStats.get_period_starts(order.complete_time).items():
+                key = period, period_start, order.region_id
+
+                if key not in stats:
+                    stats[key] = CourierStats(
+                        courier=courier,
+                        period=period,
+                        period_start=period_start,
+                        region_id=order.region_id)
+
+                stats[key].orders_count += 1
+                stats[key].delivery_seconds += delivery_time
+                stats[key].earnings += earning
+
+        CourierStats.objects.filter(courier=courier).delete()
+        CourierStats.objects.bulk_create(stats.values())
+
+    @staticmethod
+    def get_periods(courier_id, period, since=None):
+        """Рейтинг и заработок курьера по периодам
+
+        Args:
+            courier_id (int): id курьера
+            period (str): 'day' или 'week'
+            since (date): начиная с какой даты, по умолчанию - за все время
+
+        Returns:
+            list[dict]: периоды от последнего к первому
+        """
+
+        stats = CourierStats.objects.filter(courier_id=courier_id, period=period)
+
+        if since:
+            stats = stats.filter(period_start__gte=since)
+
+        periods = {}
+
+        for row in stats.order_by('-period_start').values_list(
+                'period_start', 'orders_count', 'delivery_seconds', 'earnings'):
+            periods.setdefault(row[0], []).append(row[1:])
+
+        return [
+            {
+                'period_start': period_start,
+                'orders': sum(r[0] for r in rows),
+                'earnings': sum(r[2] for r in rows),
+                'rating': rating_by_regions((r[1], r[0]) for r in rows),
+            }
+            for period_start, rows in periods.items()
+        ]
+
+
+class StatsUpdateJob(models.Model):
+    """Задача на пересчет статистики курьера
+
+    На курьера заводится не больше одной задачи, поэтому несколько
+    завершенных подряд заказов пересчитываются один раз. Задачи выполняет
+    команда process_stats_jobs.
+    """
+
+    courier = models.OneToOneField(Courier, on_delete=models.CASCADE, related_name='stats_job')
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "stats job %s" % self.courier_id
+
+    @staticmethod
+    def enqueue(courier):
+        """ Постановка задачи одним запросом, если задачи для курьера еще нет """
+
+        StatsUpdateJob.objects.bulk_create(
+            [StatsUpdateJob(courier=courier)], ignore_conflicts=True)
+
+    @staticmethod
+    def process(batch_size=100):
+        """Выполнение самых старых задач
+
+        Задача удаляется до пересчета: заказы, завершенные после этого,
+        заведут новую задачу, а завершенные раньше попадут в пересчет.
+        Если задачу уже забрал другой обработчик, она пропускается.
+        Если пересчет упал, ошибка пишется в лог, а задача ставится заново.
+
+        Returns:
+            int: число пересчитанных курьеров
+        """
+
+        jobs = list(StatsUpdateJob.objects
+                        .order_by('created', 'id')
+                        .select_related('courier')[:batch_size])
+        processed = 0
+
+        for job in jobs:
+            if not StatsUpdateJob.objects.filter(id=job.id).delete()[0]:
+                continue
+
+            try:
+                job.courier.rebuild_stats()
+            except Exception:
+                # Ошибка одного курьера не останавливает обработку очереди,
+                # задача ставится заново в конец
+                logger.exception('Не удалось пересчитать статистику курьера %s', job.courier_id)
+                StatsUpdateJob.enqueue(job.courier)
+                continue
+
+            processed += 1
+
+        return processed
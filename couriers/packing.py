@@ -0,0 +1,37 @@
+""" Подбор заказов под грузоподъемность курьера """
+
+from operator import attrgetter
+
+
+def pack_orders(orders, capacity):
+    """Укладка заказов в рюкзак (first-fit-decreasing)
+
+    Заказы перебираются от самого тяжелого к самому легкому, заказ берется,
+    если он еще помещается. Работает за O(n log n), на практике заполняет
+    грузоподъемность почти полностью, в худшем случае не меньше чем наполовину
+    от оптимума.
+
+    Args:
+        orders (list[Order]): заказы-кандидаты
+        capacity (Decimal): свободная грузоподъемность
+
+    Returns:
+        list[Order]: выбранные заказы в исходном порядке
+    """
+
+    if not orders:
+        return []
+
+    chosen = set()
+    free = capacity
+    lightest = min(o.weight for o in orders)
+
+    for order in sorted(orders, key=attrgetter('weight'), reverse=True):
+        if order.weight <= free:
+            free -= order.weight
+            chosen.add(order.id)
+
+            if free < lightest:
+                break
+
+    return [o for o in orders if o.id in chosen]
@@ -0,0 +1,113 @@
+""" Расчет сумм времени доставки по районам одним запросом """
+
+from django.db import connection
+
+from orders.models import Order
+
+
+def seconds_between(later, earlier):
+    """SQL-выражение: разность двух моментов времени в секундах
+
+    В SQLite время хранится строкой, поэтому разность считается через
+    julianday (с точностью до миллисекунд), в PostgreSQL - через EXTRACT(EPOCH).
+    """
+
+    if connection.vendor == 'sqlite':
+        return 'ROUND((julianday(%s) - julianday(%s)) * 86400, 3)' % (later, earlier)
+
+    return 'EXTRACT(EPOCH FROM %s - %s)' % (later, earlier)
+
+
+def convert_datetime(value):
+    """ Приведение datetime из курсора к виду, который возвращает ORM """
+
+    convert = getattr(connection.ops, 'convert_datetimefield_value', None)
+
+    if value is None or convert is None:
+        return value
+
+    return convert(value, None, connection)
+
+
+def region_delivery_stats(courier_ids=None):
+    """Суммы времени доставки по районам для курьеров
+
+    Время доставки первого заказа курьера - от выдачи до завершения,
+    остальных - от завершения предыдущего заказа до выдачи текущего.
+    Предыдущий заказ находится оконной функцией LAG по (complete_time, id),
+    поэтому порядок детерминирован и не зависит от порядка строк в таблице.
+
+    Args:
+        courier_ids (list[int]): id курьеров, по умолчанию - все курьеры
+
+    Returns:
+        dict: {courier_id: (region_stats, last_complete_time)},
+            region_stats - {str(region_id): [сумма в секундах, число заказов]},
+            как в Courier.region_stats
+    """
+
+    qn = connection.ops.quote_name
+    table = qn(Order._meta.db_table)
+    courier = qn(Order._meta.get_field('courier').column)
+    region = qn(Order._meta.get_field('region').column)
+    assign_time = qn(Order._meta.get_field('assign_time').column)
+    complete_time = qn(Order._meta.get_field('complete_time').column)
+
+    where = '%s IS NOT NULL' % complete_time
+    params = []
+
+    if courier_ids is not None:
+        if not courier_ids:
+            return {}
+
+        where += ' AND %s IN (%s)' % (courier, ', '.join(['%s'] * len(courier_ids)))
+        params = list(courier_ids)
+
+    sql = '''
+        SELECT courier_id, region_id, SUM(delivery_time), COUNT(*), MAX(complete_time)
+        FROM (
+            SELECT courier_id, region_id, complete_time,
+                   CASE WHEN previous_complete_time IS NULL
+                        THEN {first_delivery}
+                        ELSE {next_delivery}
+                   END AS delivery_time
+            FROM (
+                SELECT {courier} AS courier_id, {region} AS region_id,
+                       {assign_time} AS assign_time, {complete_time} AS complete_time,
+                       LAG({complete_time}) OVER (
+                           PARTITION BY {courier} ORDER BY {complete_time}, {id}
+                       ) AS previous_complete_time
+                FROM {table}
+                WHERE {where}
+            ) ordered_orders
+        ) deliveries
+        GROUP BY courier_id, region_id
+    '''.format(
+        first_delivery=seconds_between('complete_time', 'assign_time'),
+        next_delivery=seconds_between('assign_time', 'previous_complete_time'),
+        courier=courier,
+        region=region,
+        assign_time=assign_time,
+        complete_time=complete_time,
+        id=qn(Order._meta.pk.column),
+        table=table,
+        where=where,
+    )
+
+    stats = {}
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+        for courier_id, region_id, total, count, last_time in cursor.fetchall():
+            region_stats, last_complete_time = stats.get(courier_id, ({}, None))
+            last_time = convert_datetime(last_time)
+
+            region_stats[str(region_id)] = [float(total), count]
+
+            if last_complete_time is None or last_time > last_complete_time:
+                last_complete_time = last_time
+
+            stats[courier_id] = region_stats, last_complete_time
+
+    return stats
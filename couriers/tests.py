@@ -1,14 +1,36 @@
+import json
+import random
 import datetime
+from importlib import import_module
+from unittest import skipIf
 
+from django.apps import apps as django_apps
+from django.db import connection
 from django.utils import timezone
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
 from django.test import Client
 
+from couriers import matching
+from couriers.dispatch import match_orders
 from couriers.models import Courier
+from couriers.views import generate_couriers_json
+from core.testing import QueryBudgetMixin
 from orders.models import Region, Order
 
 
-class CourierTest(TestCase):
+def random_hours(rnd, count):
+    hours = []
+
+    for _ in range(count):
+        start = rnd.randrange(0, 20 * 60)
+        end = start + rnd.randrange(1, 240)
+        hours.append('%02d:%02d-%02d:%02d' % (start // 60, start % 60, end // 60, end % 60))
+
+    return hours
+
+
+class CourierTest(QueryBudgetMixin, TestCase):
     def setUp(self):
         r1 = Region.objects.create(
             name='Фрунзенский'
@@ -211,8 +233,11 @@ class CourierTest(TestCase):
 
         self.assertEqual(len(Order.objects.filter(courier=courier)), 2)
 
+        # Тело не в JSON (тестовый клиент отправляет repr словаря) не разбирается
         response = c.patch('/couriers/1/', body)
+        self.assertEqual(response.status_code, 400)
 
+        response = c.patch('/couriers/1/', json.dumps(body), content_type='application/json')
 
         courier_json = courier.to_json(fields=['regions', 'courier_type'])
 
@@ -226,5 +251,378 @@ class CourierTest(TestCase):
 
         self.assertEqual(len(Order.objects.filter(courier=courier)), 1)
 
+    def test_courier_patch_rejects_reversed_hours(self):
+        c = Client()
+
+        for hours in ["22:00-02:00", "24:30-24:45"]:
+            with self.subTest(hours=hours):
+                response = c.patch('/couriers/1/', json.dumps({'working_hours': [hours]}),
+                                   content_type='application/json')
+
+                self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(Courier.objects.get(id=1).working_hours, '09:00-10:00')
+
+    def test_courier_candidate_orders(self):
+        courier = Courier.objects.get(id=1)
+        r1, r2 = Region.objects.all()
+
+        fit = Order.objects.create(weight=5, region=r1, delivery_hours='08:00-09:30')
+        Order.objects.create(weight=11, region=r1, delivery_hours='08:00-09:30')
+        Order.objects.create(weight=5, region=r2, delivery_hours='08:00-09:30')
+        Order.objects.create(weight=5, region=r1, delivery_hours='10:00-11:00')
+        split = Order.objects.create(weight=5, region=r1, delivery_hours='07:00-08:00;11:00-12:00')
+
+        candidates = list(courier.get_candidate_orders())
+
+        self.assertEqual(candidates, [fit, split])
+        self.assertTrue(courier.can_assign_order(fit))
+        self.assertFalse(courier.can_assign_order(split))
+
+    def test_post_couriers_failed_batch_saves_nothing(self):
+        c = Client()
+        body = {
+            "data": [
+                {
+                    "courier_id": 4,
+                    "courier_type": "foot",
+                    "regions": [1],
+                    "working_hours": ["09:00-11:00"]
+                },
+                {
+                    "courier_id": 4,
+                    "courier_type": "bike",
+                    "regions": [2],
+                    "working_hours": ["09:00-18:00"]
+                },
+            ]
+        }
+
+        response = c.post('/couriers/', json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content)['validation_error']['couriers'][0]['errors'],
+            {'courier_id': {'code': 3, 'description': 'Некорректный идентификатор'}}
+        )
+        self.assertFalse(Courier.objects.filter(id=4).exists())
+
+    def test_get_couriers(self):
+        c = Client()
+
+        with self.assertNumQueries(2):
+            response = c.get('/couriers/')
+            content = b''.join(response.streaming_content)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(content), {
+            "couriers": [
+                {"courier_id": 1, "courier_type": "foot", "regions": [1], "working_hours": ["09:00-10:00"]},
+                {"courier_id": 2, "courier_type": "bike", "regions": [1, 2], "working_hours": ["09:00-10:00"]},
+                {"courier_id": 3, "courier_type": "car", "regions": [2], "working_hours": ["09:00-10:00"]},
+            ]
+        })
+
+        with self.assertNumQueries(4):
+            paged = b''.join(generate_couriers_json(page_size=2))
+
+        self.assertEqual(json.loads(paged), json.loads(content))
+
+    def test_courier_region_ids_cache(self):
+        courier = Courier.objects.get(id=2)
+        orders = list(Order.objects.all())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                [courier.can_assign_order(o) for o in orders * 10],
+                [True, True] * 10)
+
+        self.assertEqual(courier.region_ids, {1, 2})
+        self.assertEqual(courier.set_regions([2]), 0)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(courier.region_ids, {2})
+
+        self.assertEqual(courier.set_regions([2, 22]), 3)
+        self.assertEqual(Courier.objects.get(id=2).region_ids, {2})
+
+    def test_courier_patch_queries(self):
+        courier = Courier.objects.get(id=1)
+        r1 = Region.objects.get(id=1)
+
+        for _ in range(20):
+            Order.objects.create(
+                weight=5,
+                region=r1,
+                delivery_hours='09:00-12:00',
+                courier=courier,
+                assign_time=timezone.now(),
+            )
+
+        with self.assertNumQueries(6):
+            courier.patch({'working_hours': ['15:00-16:00']})
+
+        self.assertFalse(Order.objects.filter(courier=courier).exists())
+        self.assertEqual(Order.objects.filter(assign_time__isnull=True).count(), 22)
+
+    def test_post_couriers_does_not_eval(self):
+        c = Client()
+
+        response = c.post('/couriers/', {'data': ["__import__('os').getcwd()"]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', json.loads(response.content))
+
+        response = c.post('/couriers/', '{"data": [', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = c.patch('/couriers/1/', json.dumps({'rating': 5}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_couriers_without_valid_ids(self):
+        c = Client()
+        body = {'data': [
+            {'courier_id': [1], 'courier_type': 'foot', 'regions': [1], 'working_hours': []},
+            {'courier_type': 'foot'},
+            {'courier_id': {'id': 2}, 'courier_type': 'foot', 'regions': [1], 'working_hours': []},
+        ]}
+
+        response = c.post('/couriers/', json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.content)['validation_error']['couriers']
+        self.assertEqual(
+            [(e['id'], e['position'], 'courier_id' in e['errors']) for e in errors],
+            [(None, 0, True), (None, 1, True), (None, 2, True)])
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100)
+    def test_post_couriers_too_large(self):
+        c = Client()
+        body = {'data': [{'courier_id': i} for i in range(100)]}
+
+        response = c.post('/couriers/', json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 413)
+
+    @skipIf(matching.np is None, 'numpy не установлен')
+    def test_vectorised_matching_equals_scalar(self):
+        rnd = random.Random(0)
+        regions = list(Region.objects.all()) + [Region.objects.create(name='Октябрьский')]
+
+        for _ in range(300):
+            order = Order(weight=rnd.randint(1, 5000) / 100, region=rnd.choice(regions))
+            order.set_delivery_hours(random_hours(rnd, rnd.randint(1, 3)))
+            order.save()
+
+        open_orders = Order.objects.filter(assign_time__isnull=True).order_by('id')
+        columns = matching.OrderColumns.from_queryset(open_orders)
+
+        for courier in Courier.objects.all():
+            for _ in range(5):
+                courier.set_working_hours(random_hours(rnd, rnd.randint(0, 3)))
+
+                self.assertEqual(
+                    list(columns.eligible_ids(courier)),
+                    [o.id for o in open_orders if courier.can_assign_order(o)])
+
+    @skipIf(matching.np is None, 'numpy не установлен')
+    def test_matching_engine_setting(self):
+        rnd = random.Random(1)
+        regions = list(Region.objects.all())
+
+        for _ in range(200):
+            order = Order(weight=rnd.randint(1, 2000) / 100, region=rnd.choice(regions))
+            order.set_delivery_hours(random_hours(rnd, rnd.randint(1, 3)))
+            order.save()
+
+        orders = list(Order.objects.filter(assign_time__isnull=True).order_by('id'))
+        couriers = list(Courier.objects.prefetch_related('regions'))
+
+        def run():
+            return (
+                {c.id: [o.id for o in chosen] for c, chosen in match_orders(couriers, orders, {}).items()},
+                [[o.id for o in matching.assignable_orders(c, orders)] for c in couriers],
+            )
+
+        expected = run()
+
+        with self.settings(MATCHING_ENGINE='numpy'):
+            self.assertEqual(run(), expected)
+
+            orders_list, _ = Courier.objects.get(id=1).assign_orders()
+            self.assertTrue(orders_list)
+
+        with self.settings(MATCHING_ENGINE='fortran'):
+            with self.assertRaises(ImproperlyConfigured):
+                run()
+
+    def test_sql_rating_matches_reference(self):
+        rnd = random.Random(0)
+        regions = list(Region.objects.all())
+        couriers = list(Courier.objects.all())
+        start = datetime.datetime(2021, 1, 10, tzinfo=timezone.utc)
+
+        for _ in range(200):
+            complete_time = start + datetime.timedelta(
+                seconds=rnd.randrange(0, 3 * 24 * 60 * 60, 60),
+                milliseconds=rnd.choice([0, 0, 250, 999]))
+
+            Order.objects.create(
+                weight=1,
+                region=rnd.choice(regions),
+                delivery_hours='09:00-12:00',
+                courier=rnd.choice(couriers),
+                assign_time=complete_time - datetime.timedelta(seconds=rnd.randrange(0, 7200)),
+                complete_time=complete_time,
+                completed_courier_type='foot',
+            )
+
+        for courier in couriers:
+            orders = sorted(courier.get_completed_orders(), key=lambda o: (o.complete_time, o.id))
+            expected = {}
+            last_complete_time = None
+
+            for order in orders:
+                if last_complete_time is None:
+                    delivery_time = (order.complete_time - order.assign_time).total_seconds()
+                else:
+                    delivery_time = (order.assign_time - last_complete_time).total_seconds()
+
+                totals = expected.setdefault(str(order.region_id), [0, 0])
+                totals[0] += delivery_time
+                totals[1] += 1
+                last_complete_time = order.complete_time
+
+            averages = [total / count for total, count in expected.values()]
+            rating = round((3600 - min(min(averages), 3600)) / 3600 * 5, 2)
+
+            courier.set_rating()
+
+            self.assertEqual(courier.rating, rating)
+            self.assertEqual(courier.last_complete_time, last_complete_time)
+            self.assertEqual(courier.region_stats.keys(), expected.keys())
+
+            for region_id, (total, count) in expected.items():
+                self.assertAlmostEqual(courier.region_stats[region_id][0], total, places=3)
+                self.assertEqual(courier.region_stats[region_id][1], count)
+
+    def test_region_stats_backfill(self):
+        backfill = import_module('couriers.migrations.0008_backfill_region_stats').backfill_region_stats
+        rnd = random.Random(1)
+        regions = list(Region.objects.all())
+        couriers = list(Courier.objects.all())
+        start = datetime.datetime(2021, 1, 10, tzinfo=timezone.utc)
+
+        for _ in range(50):
+            complete_time = start + datetime.timedelta(seconds=rnd.randrange(0, 24 * 60 * 60, 60))
+
+            Order.objects.create(
+                weight=1,
+                region=rnd.choice(regions),
+                delivery_hours='09:00-12:00',
+                courier=rnd.choice(couriers),
+                assign_time=complete_time - datetime.timedelta(seconds=rnd.randrange(0, 7200)),
+                complete_time=complete_time,
+                completed_courier_type='foot',
+            )
+
+        # Как после миграции 0005: накопленных сумм нет
+        Courier.objects.update(region_stats={}, last_complete_time=None)
+
+        backfill(django_apps, connection.schema_editor())
+
+        for courier in Courier.objects.all():
+            backfilled = (courier.region_stats, courier.last_complete_time)
+            courier.set_rating()
+
+            self.assertEqual(backfilled[1], courier.last_complete_time)
+            self.assertEqual(backfilled[0].keys(), courier.region_stats.keys())
+
+            for region_id, (total, count) in courier.region_stats.items():
+                self.assertAlmostEqual(backfilled[0][region_id][0], total, places=3)
+                self.assertEqual(backfilled[0][region_id][1], count)
+
+    def test_query_budget_post_couriers(self):
+        c = Client()
+
+        def post(n):
+            body = {'data': [
+                {
+                    'courier_id': 100 + i,
+                    'courier_type': 'bike',
+                    'regions': [1, 2],
+                    'working_hours': ['09:00-18:00'],
+                }
+                for i in range(n)
+            ]}
+
+            return lambda: c.post('/couriers/', json.dumps(body), content_type='application/json')
+
+        self.assertQueryBudget(post, max_queries=6)
+
+    def test_query_budget_get_couriers(self):
+        c = Client()
+
+        def get(n):
+            for _ in range(n):
+                courier = Courier.objects.create(courier_type='car', working_hours='09:00-18:00')
+                courier.regions.add(1, 2)
+
+            return lambda: b''.join(c.get('/couriers/').streaming_content)
+
+        self.assertQueryBudget(get, max_queries=2)
+
+    def test_query_budget_get_courier(self):
+        c = Client()
+        courier = Courier.objects.get(id=1)
+
+        def get(n):
+            courier.regions.add(*[Region.objects.create(name='region %d' % i) for i in range(n)])
+
+            return lambda: c.get('/couriers/1/')
+
+        self.assertQueryBudget(get, max_queries=2)
+
+    def test_query_budget_patch_courier(self):
+        c = Client()
+        courier = Courier.objects.get(id=2)
+
+        def patch(n):
+            Order.objects.bulk_create([
+                Order(weight=0.01, region_id=1, delivery_hours='09:00-10:00',
+                      courier=courier, assign_time=timezone.now())
+                for _ in range(n)
+            ])
+
+            return lambda: c.patch('/couriers/2/', json.dumps({'regions': [2]}),
+                                   content_type='application/json')
+
+        self.assertQueryBudget(patch, max_queries=10)
+
+    def test_get_courier_cache(self):
+        c = Client()
+
+        response = c.get('/couriers/1/')
+        etag = response['ETag']
+
+        with self.assertNumQueries(0):
+            self.assertEqual(c.get('/couriers/1/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(c.get('/couriers/1/').content, response.content)
+
+        c.patch('/couriers/1/', json.dumps({'courier_type': 'car'}), content_type='application/json')
+
+        response = c.get('/couriers/1/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['courier_type'], 'car')
+        self.assertNotEqual(response['ETag'], etag)
+
+        courier = Courier.objects.get(id=1)
+        courier.set_regions([1, 2])
+        self.assertEqual(json.loads(c.get('/couriers/1/').content)['regions'], [1, 2])
 
+        order = Order.objects.create(weight=1, region_id=1, delivery_hours='09:00-12:00')
+        order.assign(courier, timezone.now() - datetime.timedelta(minutes=10))
+        order.save()
+        order.complete(courier.id, timezone.now())
+        self.assertEqual(json.loads(c.get('/couriers/1/').content)['earnings'], 500 * 9)
 
+        self.assertEqual(c.get('/couriers/100/').status_code, 400)
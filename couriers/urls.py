@@ -8,6 +8,7 @@ app_name = 'couriers'
 
 urlpatterns = [
     path('', views.couriers),
-    path('<int:courier_id>/', views.courier_view)
+    path('<int:courier_id>/', views.courier_view),
+    path('<int:courier_id>/stats/', views.courier_stats),
 ]
 
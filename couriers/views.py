@@ -1,97 +1,207 @@
-import json
-
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.models import User, Group
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
-
-from couriers.models import Courier
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.utils.http import parse_etags
+
+from couriers import cache as courier_cache
+from couriers.models import Courier, CourierStats
+from orders.bulk import ItemPosition
+from core.parsers import RequestDataError, compile_schema, decode_body
+from core.responses import JsonResponse, dumps
+
+
+COURIERS_PAGE_SIZE = 1000
+
+COURIERS_SCHEMA = compile_schema({
+    'type': 'object',
+    'required': ['data'],
+    'properties': {
+        'data': {'type': 'array', 'items': {'type': 'object'}},
+    },
+})
+
+COURIER_PATCH_SCHEMA = compile_schema({
+    'type': 'object',
+    'properties': {
+        'courier_type': {'type': 'string'},
+        'regions': {'type': 'array'},
+        'working_hours': {'type': 'array', 'items': {'type': 'string'}},
+    },
+    'additionalProperties': False,
+})
 
 
 def generate_objects_by_id(key, ids_list, problems=None):
-    values = [{'id': i} for i in ids_list]
+    """ Элементы без корректного id выдаются с id null и позицией в списке """
+
+    values = [
+        {'id': None, 'position': i.position} if isinstance(i, ItemPosition) else {'id': i}
+        for i in ids_list
+    ]
 
     if problems:
-        for d in values:
-            d['errors'] = problems[d['id']]
+        for i, d in zip(ids_list, values):
+            d['errors'] = problems[i]
 
     return {
         key: values
     }
     
 
-@csrf_exempt
-def couriers(request):
-    if request.method == 'POST':
-        problems = {}
-        invalid_ids = []
-        couriers = []
+def generate_couriers_json(page_size=COURIERS_PAGE_SIZE):
+    """Тело ответа {"couriers": [...]} по частям
+
+    Курьеры читаются страницами по id (keyset-пагинация), регионы каждой
+    страницы загружаются одним запросом, поэтому в памяти одновременно
+    находится не больше page_size курьеров.
+    """
+
+    yield b'{"couriers": ['
+
+    separator = b''
+    last_id = 0
+
+    while True:
+        page = list(Courier.objects
+                        .filter(id__gt=last_id)
+                        .order_by('id')
+                        .prefetch_related('regions')[:page_size])
+
+        for courier in page:
+            yield separator + dumps(courier.to_json())
+            separator = b', '
+
+        if len(page) < page_size:
+            break
 
-        if not request.POST:
-            data_list = json.loads(request.body)['data']
-        else:
-            data_list = [eval(d) for d in request.POST.getlist('data')]
+        last_id = page[-1].id
 
-        for courier_json in data_list:
-            courier = Courier.from_json(courier_json)
+    yield b']}'
 
-            if not isinstance(courier, Courier):
-                invalid_ids.append(courier_json['courier_id'])
-                problems[courier_json['courier_id']] = courier
 
-            couriers.append(courier)
+@csrf_exempt
+def couriers(request):
+    if request.method == 'POST':
+        try:
+            data_list = decode_body(request, COURIERS_SCHEMA, form_lists=('data',))['data']
+        except RequestDataError as e:
+            return JsonResponse({'error': e.message}, status=e.status)
 
-        if invalid_ids:
+        couriers, problems = Courier.bulk_from_json(data_list)
+
+        if problems:
             return JsonResponse(
                 {
                     'validation_error': 
-                            generate_objects_by_id('couriers', invalid_ids, problems)
+                            generate_objects_by_id('couriers', list(problems), problems)
                 },
                 status=400
             )
 
-        
-        for c in couriers:
-            c.save()
-
         return JsonResponse(
             generate_objects_by_id(
                 'couriers', 
                 [c.id for c in couriers]), 
             status=201)
 
-    couriers = Courier.objects.all()
+    return StreamingHttpResponse(
+        generate_couriers_json(),
+        content_type='application/json')
 
-    return JsonResponse({
-        'couriers': [c.to_json() for c in couriers]
-    })
+
+def load_courier_detail(courier_id):
+    """ Тело ответа GET /couriers/<id>/ из базы, None - если курьера нет """
+
+    courier = Courier.objects.filter(id=courier_id).prefetch_related('regions').first()
+
+    if not courier:
+        return None
+
+    return dumps(courier.to_json(
+        fields=['courier_id', 'courier_type', 'regions', 'working_hours', 'rating', 'earnings']
+    ))
+
+
+def courier_detail(request, courier_id):
+    """Курьер с рейтингом и заработком через кэш couriers.cache
+
+    Если ETag из If-None-Match совпадает с текущей версией в кэше,
+    отвечаем 304 без запросов к базе.
+    """
+
+    version = courier_cache.get_version(courier_id)
+
+    if version is not None:
+        etag = courier_cache.make_etag(courier_id, version)
+
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+    content, etag = courier_cache.get_detail(
+        courier_id, lambda: load_courier_detail(courier_id))
+
+    if content is None:
+        return JsonResponse({"error": 0}, status=400)
+
+    response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+
+    return response
 
 
 @csrf_exempt
 def courier_view(request, courier_id):
-    data = {}
+    if request.method != "PATCH":
+        return courier_detail(request, courier_id)
+
     courier = Courier.objects.filter(id=courier_id).first()
 
     if not courier:
         return JsonResponse({"error": 0}, status=400)
 
-    if request.method == "PATCH":
-        body_unicode = request.body.decode('utf-8')
-        body = eval(body_unicode)
+    try:
+        body = decode_body(request, COURIER_PATCH_SCHEMA)
+    except RequestDataError as e:
+        return JsonResponse({'error': e.message}, status=e.status)
 
-        courier = courier.patch(body)
+    courier = courier.patch(body)
 
-        if isinstance(courier, Courier):
-            return JsonResponse(courier.to_json(), status=200)
+    if isinstance(courier, Courier):
+        return JsonResponse(courier.to_json(), status=200)
 
-        return JsonResponse(
-            courier,
-            status=400
-        )
+    return JsonResponse(
+        courier,
+        status=400
+    )
+
+
+def courier_stats(request, courier_id):
+    """Рейтинг, заработок и число заказов курьера по дням или неделям
+
+    GET /couriers/<id>/stats/?period=day|week&since=YYYY-MM-DD
+    """
+
+    period = request.GET.get('period', 'day')
+    since = request.GET.get('since')
+
+    if period not in dict(CourierStats.PERIODS):
+        return JsonResponse({'error': 'period'}, status=400)
 
-    if courier:
-        data = courier.to_json(
-            fields=['courier_id', 'courier_type', 'regions', 'working_hours', 'rating', 'earnings']
-        )
+    if since:
+        since = parse_date(since)
 
-    return JsonResponse(data, safe=True)
\ No newline at end of file
+        if not since:
+            return JsonResponse({'error': 'since'}, status=400)
+
+    if not Courier.objects.filter(id=courier_id).exists():
+        return JsonResponse({"error": 0}, status=400)
+
+    return JsonResponse({
+        'courier_id': courier_id,
+        'period': period,
+        'stats': CourierStats.get_periods(courier_id, period, since),
+    })
@@ -0,0 +1,154 @@
+""" Вспомогательные функции для пакетной загрузки объектов """
+
+from collections import namedtuple
+
+from django.db import connections
+from django.db.models import Case, Value, When
+
+
+# Ключ ошибок элемента без корректного id - его позиция в списке
+ItemPosition = namedtuple('ItemPosition', 'position')
+
+
+def is_integer(value):
+    """ Целое число, но не bool """
+
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def problem_key(data, field, position):
+    """Ключ ошибок элемента списка
+
+    Args:
+        data (dict): элемент
+        field (str): поле с id
+        position (int): позиция элемента в списке
+
+    Returns:
+        int или ItemPosition: id, если он целый, иначе позиция
+    """
+
+    value = data.get(field)
+
+    return value if is_integer(value) else ItemPosition(position)
+
+
+def existing_values(queryset, values, field='id'):
+    """Какие из значений уже есть в базе данных
+
+    Значения проверяются запросами field IN (...), разбитыми на части
+    по ограничению базы данных на число параметров запроса.
+
+    Args:
+        queryset (QuerySet): где искать
+        values (iterable): проверяемые значения
+        field (str): поле модели
+
+    Returns:
+        set: найденные значения
+    """
+
+    values = list(set(values))
+    batch_size = connections[queryset.db].features.max_query_params or len(values) or 1
+
+    found = set()
+
+    for i in range(0, len(values), batch_size):
+        found.update(queryset
+                        .filter(**{field + '__in': values[i:i + batch_size]})
+                        .values_list(field, flat=True))
+
+    return found
+
+
+def update_by_ids(queryset, ids, **values):
+    """Обновление полей у объектов с id из ids
+
+    Выполняется запросами UPDATE ... WHERE id IN (...), разбитыми на части
+    по ограничению базы данных на число параметров запроса.
+
+    Returns:
+        int: число обновленных строк
+    """
+
+    ids = list(ids)
+    limit = connections[queryset.db].features.max_query_params
+    # Значения в SET тоже передаются параметрами
+    batch_size = limit - len(values) if limit else max(len(ids), 1)
+
+    updated = 0
+
+    for i in range(0, len(ids), batch_size):
+        updated += queryset.filter(id__in=ids[i:i + batch_size]).update(**values)
+
+    return updated
+
+
+# База перебирает ветки CASE для каждой строки, поэтому время UPDATE растет
+# квадратично от размера пачки, даже если ограничения на параметры нет
+MAX_CASE_ROWS = 200
+
+
+def update_cases_by_ids(queryset, values, **constants):
+    """Обновление у каждого объекта своими значениями
+
+    Выполняется запросами UPDATE ... SET field = CASE WHEN id = ... END
+    WHERE id IN (...), разбитыми на части по ограничению базы данных
+    на число параметров запроса и не больше MAX_CASE_ROWS строк.
+
+    Args:
+        queryset (QuerySet): какие объекты можно обновлять
+        values (dict): {id: {поле: значение}}, у всех объектов одни и те же поля
+        constants: значения, одинаковые для всех объектов
+
+    Returns:
+        int: число обновленных строк
+    """
+
+    if not values:
+        return 0
+
+    ids = list(values)
+    fields = list(values[ids[0]])
+    limit = connections[queryset.db].features.max_query_params
+    batch_size = MAX_CASE_ROWS
+
+    if limit:
+        # На каждый объект - id и значение в каждом CASE и id в IN
+        batch_size = min(batch_size, (limit - len(constants)) // (2 * len(fields) + 1))
+
+    updated = 0
+
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        cases = {
+            field: Case(
+                *[When(id=pk, then=Value(values[pk][field])) for pk in batch],
+                output_field=queryset.model._meta.get_field(field))
+            for field in fields
+        }
+
+        updated += queryset.filter(id__in=batch).update(**cases, **constants)
+
+    return updated
+
+
+def objects_by_ids(queryset, ids):
+    """Объекты с id из ids
+
+    Выбираются запросами id IN (...), разбитыми на части
+    по ограничению базы данных на число параметров запроса.
+
+    Returns:
+        list: найденные объекты
+    """
+
+    ids = list(ids)
+    batch_size = connections[queryset.db].features.max_query_params or len(ids) or 1
+
+    found = []
+
+    for i in range(0, len(ids), batch_size):
+        found.extend(queryset.filter(id__in=ids[i:i + batch_size]))
+
+    return found
@@ -0,0 +1,212 @@
+"""Индекс свободных заказов в памяти процесса
+
+Свободные заказы раскладываются по корзинам (район, слот времени доставки),
+в каждой корзине заказы отсортированы по весу. Индекс строится при первом
+обращении и затем обновляется по журналу OrderChange: перечитываются только
+заказы, изменившиеся с версии индекса (последнего прочитанного id журнала).
+Если изменений слишком много или индекс слишком старый, он строится заново.
+
+id журнала выдаются без блокировок, и транзакция с меньшим id может
+закоммититься позже транзакции с большим. Пропущенные id запоминаются
+и перечитываются, пока не появятся или пока не пройдет MAX_GAP_AGE секунд
+(транзакция откатилась или id пропущен последовательностью).
+
+Индекс может отставать от базы, поэтому заказы из него забираются условным
+UPDATE ... WHERE assign_time IS NULL (Courier.claim_orders).
+"""
+
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from math import inf
+
+from django.conf import settings
+
+from orders.bulk import objects_by_ids
+from orders.intervals import interval_slots
+from orders.models import Order, OrderChange
+
+
+# Сколько изменений применять по журналу, при большем числе индекс строится заново.
+# prune_order_changes по умолчанию оставляет столько же записей
+MAX_INCREMENTAL_CHANGES = 10000
+
+# Сколько секунд ждать запись журнала с пропущенным id
+MAX_GAP_AGE = 60
+
+
+def bucket_orders(orders):
+    """Корзины заказов
+
+    Returns:
+        dict: {(id района, слот): [(вес, id заказа)]}, списки отсортированы по весу
+    """
+
+    buckets = defaultdict(list)
+
+    for order in orders:
+        for slot in interval_slots(order.delivery_intervals):
+            buckets[order.region_id, slot].append((order.weight, order.id))
+
+    for bucket in buckets.values():
+        bucket.sort()
+
+    return buckets
+
+
+def open_orders_queryset():
+    return Order.objects.filter(assign_time__isnull=True).only(
+        'id', 'weight', 'region', 'delivery_hours')
+
+
+class OpenOrderIndex:
+    """ Свободные заказы по корзинам (район, слот) """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Сброс индекса, он будет построен заново при следующем обращении """
+
+        self.version = None
+        self.gaps = {}
+        self.built = 0
+        self.orders = {}
+        self.buckets = defaultdict(list)
+
+    def rebuild(self):
+        """Построение индекса по всем свободным заказам
+
+        Версия читается до заказов: изменения, закоммиченные между
+        этими запросами, будут применены еще раз при следующем обновлении,
+        что безопасно, так как заказы перечитываются из базы. Пропуски
+        среди последних id журнала могут быть еще не закоммиченными
+        изменениями, они ждут так же, как в refresh.
+        """
+
+        recent = list(OrderChange.objects
+                        .order_by('-id')
+                        .values_list('id', flat=True)[:MAX_INCREMENTAL_CHANGES])
+        orders = list(open_orders_queryset())
+        version = recent[0] if recent else 0
+        now = time.monotonic()
+
+        self.orders = {order.id: order for order in orders}
+        self.buckets = bucket_orders(orders)
+        self.version = version
+        self.gaps = dict.fromkeys(set(range(recent[-1], version + 1)) - set(recent), now) if recent else {}
+        self.built = now
+
+    def refresh(self):
+        """Применение изменений из журнала
+
+        Стоит одного запроса: читаются записи после версии индекса
+        и после самого старого пропуска.
+        """
+
+        max_age = getattr(settings, 'OPEN_ORDER_INDEX_MAX_AGE', 300)
+        now = time.monotonic()
+
+        if self.version is None or now - self.built > max_age:
+            return self.rebuild()
+
+        since = min(self.gaps, default=self.version + 1) - 1
+        changes = list(OrderChange.objects
+                        .filter(id__gt=since)
+                        .order_by('id')
+                        .values_list('id', 'order_id')[:MAX_INCREMENTAL_CHANGES + 1])
+
+        version = max(self.version, changes[-1][0] if changes else 0)
+
+        # Версия, отставшая больше чем на MAX_INCREMENTAL_CHANGES id,
+        # могла попасть в уже почищенную часть журнала
+        if len(changes) > MAX_INCREMENTAL_CHANGES or version - self.version > MAX_INCREMENTAL_CHANGES:
+            return self.rebuild()
+
+        fresh = [(i, order_id) for i, order_id in changes if i > self.version or i in self.gaps]
+
+        # Записи с id меньше версии могли закоммититься позже нее
+        self.gaps.update(dict.fromkeys(
+            set(range(self.version + 1, version + 1)) - {i for i, _ in fresh}, now))
+
+        for i, _ in fresh:
+            self.gaps.pop(i, None)
+
+        self.gaps = {i: seen for i, seen in self.gaps.items() if now - seen < MAX_GAP_AGE}
+        self.version = version
+
+        changed = {order_id for _, order_id in fresh}
+
+        self.discard(changed)
+
+        for order in objects_by_ids(open_orders_queryset(), changed):
+            self.add(order)
+
+    def add(self, order):
+        self.orders[order.id] = order
+
+        for slot in interval_slots(order.delivery_intervals):
+            insort(self.buckets[order.region_id, slot], (order.weight, order.id))
+
+    def discard(self, order_ids):
+        """ Удаление заказов из индекса, например, только что выданных """
+
+        for order_id in order_ids:
+            order = self.orders.pop(order_id, None)
+
+            if order is None:
+                continue
+
+            for slot in interval_slots(order.delivery_intervals):
+                bucket = self.buckets[order.region_id, slot]
+                del bucket[bisect_left(bucket, (order.weight, order.id))]
+
+    def candidates(self, region_ids, intervals, capacity):
+        """Свободные заказы районов и слотов курьера не тяжелее capacity
+
+        Индекс предварительно обновляется по журналу.
+
+        Args:
+            region_ids (iterable[int]): районы курьера
+            intervals (tuple): рабочие промежутки курьера в минутах
+            capacity (Decimal): свободная грузоподъемность
+
+        Returns:
+            list[Order]: заказы в порядке id, точная проверка времени
+                остается за can_assign_order
+        """
+
+        with self.lock:
+            self.refresh()
+
+            found = set()
+            slots = interval_slots(intervals)
+
+            for region_id in region_ids:
+                for slot in slots:
+                    bucket = self.buckets.get((region_id, slot))
+
+                    if bucket:
+                        end = bisect_right(bucket, (capacity, inf))
+                        found.update(order_id for _, order_id in bucket[:end])
+
+            return [self.orders[order_id] for order_id in sorted(found)]
+
+    def snapshot(self):
+        """ Все свободные заказы после обновления индекса, в порядке id """
+
+        with self.lock:
+            self.refresh()
+
+            return [self.orders[order_id] for order_id in sorted(self.orders)]
+
+    def forget(self, order_ids):
+        """ Удаление выданных заказов, не дожидаясь журнала """
+
+        with self.lock:
+            self.discard(order_ids)
+
+
+open_orders = OpenOrderIndex()
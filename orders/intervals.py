@@ -0,0 +1,140 @@
+""" Промежутки времени формата %H:%M-%H:%M в виде минут от начала суток """
+
+
+def time_to_minutes(time):
+    """ Перевод времени формата %H:%M в минуты от начала суток """
+
+    hours, minutes = time.split(':')
+    hours, minutes = int(hours), int(minutes)
+
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise ValueError('time out of range: %s' % time)
+
+    return hours * 60 + minutes
+
+
+def parse_hours(hours, strict=False):
+    """Разбор строки промежутков
+
+    Args:
+        hours (str): промежутки формата %H:%M-%H:%M, разделенные ';'
+        strict (bool): проверять, что промежуток не переходит через полночь
+            и заканчивается не позже 24:00 (для новых значений, уже
+            сохраненные строки читаются как есть)
+
+    Returns:
+        tuple[tuple[int, int]]: отсортированные промежутки в минутах
+    """
+
+    intervals = []
+
+    for interval in hours.split(';'):
+        if not interval:
+            continue
+
+        start, end = interval.split('-')
+        start, end = time_to_minutes(start), time_to_minutes(end)
+
+        if strict and not start < end <= 24 * 60:
+            raise ValueError('invalid interval: %s' % interval)
+
+        intervals.append((start, end))
+
+    return tuple(sorted(intervals))
+
+
+def delivery_bounds(intervals):
+    """Границы промежутков доставки для отбора заказов в базе данных
+
+    Args:
+        intervals (tuple[tuple[int, int]]): отсортированные промежутки в минутах
+
+    Returns:
+        tuple[int, int]: начало первого промежутка и наибольший конец
+    """
+
+    start = intervals[0][0] if intervals else 0
+    end = max((end for _, end in intervals), default=0)
+
+    return start, end
+
+
+def intervals_overlap(first, second):
+    """Пересекается ли хотя-бы один промежуток first с промежутком second
+
+    Оба списка должны быть отсортированы по началу промежутка,
+    проверка проходит их одновременно за O(len(first) + len(second)).
+    """
+
+    i = j = 0
+
+    while i < len(first) and j < len(second):
+        start, end = first[i]
+        other_start, other_end = second[j]
+
+        if end <= other_start:
+            i += 1
+        elif other_end <= start:
+            j += 1
+        else:
+            return True
+
+    return False
+
+
+SLOT_MINUTES = 30
+
+
+def interval_slots(intervals, size=SLOT_MINUTES):
+    """Номера слотов по size минут, которые задевают промежутки
+
+    Args:
+        intervals (tuple[tuple[int, int]]): промежутки в минутах
+
+    Returns:
+        set[int]: номера слотов от начала суток
+    """
+
+    return {slot
+            for start, end in intervals if start < end
+            for slot in range(start // size, (end - 1) // size + 1)}
+
+
+class ParsedHours:
+    """Промежутки строкового поля модели, разобранные один раз
+
+    Результат хранится в экземпляре вместе с исходной строкой и
+    пересчитывается, только если значение поля изменилось.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __set_name__(self, owner, name):
+        self.cache_name = '_%s_cache' % name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        hours = getattr(instance, self.field)
+        cached = instance.__dict__.get(self.cache_name)
+
+        if cached is None or cached[0] != hours:
+            cached = (hours, parse_hours(hours))
+            instance.__dict__[self.cache_name] = cached
+
+        return cached[1]
+
+    def set(self, instance, hours):
+        """Запись нового значения поля вместе с разобранными промежутками
+
+        Raises:
+            ValueError: если строка не соответствует формату
+                или промежуток некорректен
+        """
+
+        intervals = parse_hours(hours, strict=True)
+
+        setattr(instance, self.field, hours)
+        instance.__dict__[self.cache_name] = (hours, intervals)
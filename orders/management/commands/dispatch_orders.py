@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from couriers.dispatch import dispatch_orders
+
+
+class Command(BaseCommand):
+    help = 'Распределение всех свободных заказов между всеми курьерами'
+
+    def handle(self, *args, **options):
+        result = dispatch_orders()
+
+        for courier, (orders, assign_time) in result.items():
+            self.stdout.write('%s: %d заказов' % (courier, len(orders)))
+
+        self.stdout.write('Выдано %d заказов %d курьерам' % (
+            sum(len(orders) for orders, _ in result.values()), len(result)))
@@ -0,0 +1,238 @@
+import json
+import time
+import random
+import itertools
+import threading
+import collections
+
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.utils import timezone
+
+from benchmarks import utils
+
+
+# Доли запросов каждого вида в сценарии нагрузки
+SCENARIO = {
+    'GET /couriers/<id>/': 30,
+    'PATCH /couriers/<id>/': 5,
+    'POST /couriers/': 5,
+    'POST /orders/': 15,
+    'POST /orders/assign/': 25,
+    'POST /orders/complete/': 20,
+}
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест API: синтетические данные во временной базе и '
+            'одновременные клиенты через WSGI приложение. Для каждого эндпоинта '
+            'выводятся p50/p95/p99 задержки, пропускная способность и число запросов к БД')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--regions', type=int, default=20)
+        parser.add_argument('--couriers', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--clients', type=int, default=8,
+                            help='число одновременных клиентов (потоков)')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='число запросов каждого клиента')
+        parser.add_argument('--batch', type=int, default=10,
+                            help='число курьеров/заказов в одном POST')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # SQLite база создается в файле, чтобы ее видели все потоки
+        name = 'bench_loadtest.sqlite3' if connection.vendor == 'sqlite' else None
+
+        with utils.test_database(name=name):
+            self.prepare(options)
+            stats, elapsed = self.run(options)
+
+        self.report(stats, elapsed)
+
+    def prepare(self, options):
+        """ Синтетические регионы, курьеры и свободные заказы """
+
+        from couriers.models import Courier
+        from orders.models import Order
+
+        rnd = random.Random(options['seed'])
+        regions = utils.create_regions(options['regions'])
+
+        self.region_ids = [r.id for r in regions]
+        self.courier_ids = list(range(1, options['couriers'] + 1))
+
+        Courier.bulk_from_json([self.courier_json(rnd, i) for i in self.courier_ids])
+        utils.create_orders(options['orders'], regions, seed=options['seed'], max_weight=10)
+
+        last_order = Order.objects.order_by('-id').first()
+
+        self.next_courier_id = itertools.count(options['couriers'] + 1)
+        self.next_order_id = itertools.count((last_order.id if last_order else 0) + 1)
+        self.assigned = collections.deque()
+
+    def courier_json(self, rnd, courier_id):
+        return {
+            'courier_id': courier_id,
+            'courier_type': rnd.choice(['foot', 'bike', 'car']),
+            'regions': rnd.sample(self.region_ids, min(3, len(self.region_ids))),
+            'working_hours': utils.random_hours(rnd, rnd.randint(1, 2), 120, 600),
+        }
+
+    def order_json(self, rnd, order_id):
+        return {
+            'order_id': order_id,
+            'weight': round(rnd.uniform(0.01, 10), 2),
+            'region': rnd.choice(self.region_ids),
+            'delivery_hours': utils.random_hours(rnd, rnd.randint(1, 3)),
+        }
+
+    def run(self, options):
+        """Запуск клиентов
+
+        Returns:
+            tuple: ({эндпоинт: [(мс, запросов к БД, успешно)]}, время в секундах)
+        """
+
+        application = get_wsgi_application()
+        start_event = threading.Event()
+        results = []
+
+        def client(seed):
+            rnd = random.Random(seed)
+            samples = collections.defaultdict(list)
+
+            with utils.QueryCounter(connection) as counter:
+                start_event.wait()
+
+                for _ in range(options['requests']):
+                    endpoint = rnd.choices(list(SCENARIO), weights=list(SCENARIO.values()))[0]
+                    queries = counter.count
+                    start = time.perf_counter()
+
+                    endpoint, ok = self.request(application, rnd, endpoint, options)
+
+                    samples[endpoint].append((
+                        (time.perf_counter() - start) * 1000,
+                        counter.count - queries,
+                        ok,
+                    ))
+
+            connections.close_all()
+            results.append(samples)
+
+        threads = [
+            threading.Thread(target=client, args=(options['seed'] + i,))
+            for i in range(options['clients'])
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        start_event.set()
+
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.perf_counter() - start
+
+        stats = collections.defaultdict(list)
+
+        for samples in results:
+            for endpoint, values in samples.items():
+                stats[endpoint].extend(values)
+
+        return stats, elapsed
+
+    def request(self, application, rnd, endpoint, options):
+        """Один запрос сценария
+
+        Returns:
+            tuple: (фактический эндпоинт, успешен ли ответ)
+        """
+
+        if endpoint == 'POST /orders/complete/':
+            try:
+                courier_id, order_id = self.assigned.popleft()
+            except IndexError:
+                endpoint = 'POST /orders/assign/'
+            else:
+                status, _ = utils.wsgi_request(application, 'POST', '/orders/complete/', {
+                    'courier_id': courier_id,
+                    'order_id': order_id,
+                    'complete_time': timezone.now().isoformat(),
+                })
+                return endpoint, status == 200
+
+        if endpoint == 'POST /orders/assign/':
+            courier_id = rnd.choice(self.courier_ids)
+            status, content = utils.wsgi_request(
+                application, 'POST', '/orders/assign/', {'courier_id': courier_id})
+
+            if status == 200:
+                for order in json.loads(content)['orders']:
+                    self.assigned.append((courier_id, order['id']))
+
+            return endpoint, status == 200
+
+        if endpoint == 'GET /couriers/<id>/':
+            status, _ = utils.wsgi_request(
+                application, 'GET', '/couriers/%d/' % rnd.choice(self.courier_ids))
+            return endpoint, status == 200
+
+        if endpoint == 'PATCH /couriers/<id>/':
+            status, _ = utils.wsgi_request(
+                application, 'PATCH', '/couriers/%d/' % rnd.choice(self.courier_ids),
+                {'working_hours': utils.random_hours(rnd, rnd.randint(1, 2), 120, 600)})
+            return endpoint, status == 200
+
+        if endpoint == 'POST /couriers/':
+            data = [self.courier_json(rnd, next(self.next_courier_id))
+                    for _ in range(options['batch'])]
+            status, _ = utils.wsgi_request(application, 'POST', '/couriers/', {'data': data})
+
+            if status == 201:
+                self.courier_ids.extend(c['courier_id'] for c in data)
+
+            return endpoint, status == 201
+
+        data = [self.order_json(rnd, next(self.next_order_id)) for _ in range(options['batch'])]
+        status, _ = utils.wsgi_request(application, 'POST', '/orders/', {'data': data})
+
+        return endpoint, status == 201
+
+    def report(self, stats, elapsed):
+        rows = []
+        total = []
+
+        for endpoint in SCENARIO:
+            values = stats.get(endpoint)
+
+            if not values:
+                continue
+
+            total.extend(values)
+            rows.append(self.row(endpoint, values, elapsed))
+
+        rows.append(self.row('total', total, elapsed))
+
+        utils.print_table(
+            ['endpoint', 'requests', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'req/sec', 'queries'],
+            rows,
+            write=self.stdout.write)
+
+    def row(self, endpoint, values, elapsed):
+        timings = sorted(ms for ms, _, _ in values)
+
+        return [
+            endpoint,
+            len(values),
+            sum(1 for _, _, ok in values if not ok),
+            '%.1f' % utils.percentile(timings, 50),
+            '%.1f' % utils.percentile(timings, 95),
+            '%.1f' % utils.percentile(timings, 99),
+            '%.0f' % (len(values) / elapsed),
+            '%.1f' % (sum(q for _, q, _ in values) / len(values)),
+        ]
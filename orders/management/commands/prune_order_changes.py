@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from orders.models import OrderChange
+
+
+class Command(BaseCommand):
+    help = ('Удаление старых записей журнала свободных заказов '
+            '(используется при OPEN_ORDER_INDEX = True)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep', type=int, default=10000,
+                            help='число последних записей, которые остаются в журнале')
+
+    def handle(self, *args, **options):
+        deleted = OrderChange.prune(options['keep'])
+
+        self.stdout.write('Удалено записей журнала: %d' % deleted)
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.7 on 2026-10-18 06:54
+
+from django.db import migrations, models
+
+from orders.intervals import delivery_bounds, parse_hours
+
+
+def fill_delivery_bounds(apps, schema_editor):
+    """ Границы промежутков доставки по тому же правилу, что и Order.set_delivery_bounds """
+
+    Order = apps.get_model('orders', 'Order')
+    db = schema_editor.connection.alias
+
+    ids = list(Order.objects.using(db).order_by('id').values_list('id', flat=True))
+
+    for i in range(0, len(ids), 500):
+        updated = list(Order.objects.using(db).filter(id__in=ids[i:i + 500]).only('id', 'delivery_hours'))
+
+        for order in updated:
+            order.delivery_start, order.delivery_end = delivery_bounds(parse_hours(order.delivery_hours))
+
+        Order.objects.using(db).bulk_update(updated, ['delivery_start', 'delivery_end'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_order_completed_courier_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='delivery_end',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_start',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['region', 'assign_time', 'weight'], name='order_open_lookup_idx'),
+        ),
+        migrations.RunPython(fill_delivery_bounds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_delivery_bounds'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_open_lookup_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(assign_time__isnull=True), fields=['region', 'weight'], name='order_open_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['courier', 'complete_time'], name='order_courier_complete_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('complete_time__isnull', True), ('courier__isnull', False)), fields=['courier', 'weight'], name='order_in_progress_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.7 on 2026-10-18 07:53
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_changes'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='OrderVersion',
+        ),
+        migrations.RemoveField(
+            model_name='orderchange',
+            name='version',
+        ),
+    ]
@@ -1,6 +1,13 @@
 import datetime
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from orders.bulk import existing_values, is_integer, problem_key
+from orders.intervals import ParsedHours, delivery_bounds
 
 
 class Region(models.Model):
@@ -21,15 +28,38 @@ class Order(models.Model):
 
     completed_courier_type = models.CharField(max_length=4, blank=True, null=True)
 
+    # Границы всех промежутков доставки в минутах от начала суток,
+    # нужны для отбора подходящих заказов на стороне базы данных
+    delivery_start = models.PositiveSmallIntegerField(default=0)
+    delivery_end = models.PositiveSmallIntegerField(default=0)
+
+    delivery_intervals = ParsedHours('delivery_hours')
+
     VALIDATION_ERRORS = {
         1: 'Не задано значение',
         2: 'Не соответствует формату',
         3: 'Некорректный идентификатор'
     }
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['region', 'weight'],
+                         condition=Q(assign_time__isnull=True),
+                         name='order_open_region_idx'),
+            models.Index(fields=['courier', 'complete_time'],
+                         name='order_courier_complete_idx'),
+            models.Index(fields=['courier', 'weight'],
+                         condition=Q(courier__isnull=False, complete_time__isnull=True),
+                         name='order_in_progress_idx'),
+        ]
+
     def __str__(self):
         return "order %d" % self.id
 
+    def save(self, *args, **kwargs):
+        self.set_delivery_bounds()
+        super().save(*args, **kwargs)
+
     @property
     def delivery_time_in_seconds(self):
         """ Время доставки заказа в секундах
@@ -68,11 +98,78 @@ class Order(models.Model):
             dict: коды и описания ошибок, если не прошло валидацию
             Order: сформированный заказ
         """
+
+        orders, problems = Order.bulk_from_json([data])
+
+        if problems:
+            return next(iter(problems.values()))
+
+        return orders[0]
+
+    @staticmethod
+    def bulk_from_json(data_list, batch_size=1000):
+        """Создание заказов из списка json одним пакетом
+
+        Занятые id и существующие регионы определяются для всего списка
+        несколькими запросами IN, заказы сохраняются через bulk_create
+        в одной транзакции. Если хотя-бы один заказ не прошел валидацию,
+        ничего не сохраняется.
+
+        Args:
+            data_list (list[dict]): описания заказов в формате json
+            batch_size (int): размер пачки для bulk_create
+
+        Returns:
+            list[Order]: сохраненные заказы
+            dict: ошибки по id заказов, не прошедших валидацию
+        """
+
+        taken_ids = existing_values(
+            Order.objects.all(),
+            [d['order_id'] for d in data_list if is_integer(d.get('order_id'))])
+
+        region_ids = existing_values(
+            Region.objects.all(),
+            [d['region'] for d in data_list if is_integer(d.get('region'))])
+
+        orders = []
         problems = {}
 
-        fields = ['order_id', 'weight', 'region', 'delivery_hours']
+        for position, data in enumerate(data_list):
+            order = Order()
+            errors = order.validate_json(data, taken_ids, region_ids)
+
+            if errors:
+                problems[problem_key(data, 'order_id', position)] = errors
+                continue
+
+            order.set_delivery_bounds()
+            orders.append(order)
+
+        if problems:
+            return [], problems
 
-        order = Order()
+        with transaction.atomic():
+            Order.objects.bulk_create(orders, batch_size=batch_size)
+            OrderChange.record([o.id for o in orders])
+
+        return orders, problems
+
+    def validate_json(self, data, taken_ids, region_ids):
+        """Заполнение полей из json без запросов к базе данных
+
+        Args:
+            data (dict): словарь с атрибутами и их значениями
+            taken_ids (set[int]): занятые id, id заказа добавляется к ним
+            region_ids (set[int]): существующие id регионов
+
+        Returns:
+            dict: коды и описания ошибок, пустой, если валидация пройдена
+        """
+
+        problems = {}
+
+        fields = ['order_id', 'weight', 'region', 'delivery_hours']
 
         for field in fields:
             if not field in data:
@@ -84,28 +181,39 @@ class Order(models.Model):
         if problems:
             return problems
 
-        methods = [
-            order.set_id, 
-            order.set_weight, 
-            order.set_region,
-            order.set_delivery_hours]
+        order_id = data['order_id']
+
+        if not is_integer(order_id):
+            id_code = 2
+        elif order_id in taken_ids:
+            id_code = 3
+        else:
+            id_code = 0
+            self.id = order_id
+            taken_ids.add(order_id)
+
+        region_id = data['region']
 
-        for method, field in zip(methods, fields):
-            code = method(data[field])
+        if is_integer(region_id) and region_id in region_ids:
+            region_code = 0
+            self.region_id = region_id
+        else:
+            region_code = 3
 
+        codes = [
+            id_code,
+            self.set_weight(data['weight']),
+            region_code,
+            self.set_delivery_hours(data['delivery_hours'])]
+
+        for code, field in zip(codes, fields):
             if code != 0:
                 problems[field] = {
                     'code': code,
-                    'description': order.VALIDATION_ERRORS[code]
+                    'description': self.VALIDATION_ERRORS[code]
                 }
 
-        if problems:
-            return problems
-            
-
-        order.save()
-
-        return order
+        return problems
 
     def set_id(self, new_id):
         """ Изменение id 
@@ -135,7 +243,7 @@ class Order(models.Model):
             <int:id>, если вызвалась ошибка
         """
 
-        if weight > 0:
+        if isinstance(weight, (int, float)) and not isinstance(weight, bool) and weight > 0:
             self.weight = weight
             return 0
 
@@ -171,9 +279,21 @@ class Order(models.Model):
             <int:id>, если вызвалась ошибка
         """
 
-        self.delivery_hours = ';'.join(delivery_hours)
+        if not isinstance(delivery_hours, list) or not all(isinstance(h, str) for h in delivery_hours):
+            return 2
+
+        try:
+            Order.delivery_intervals.set(self, ';'.join(delivery_hours))
+        except ValueError:
+            return 2
+
         return 0
 
+    def set_delivery_bounds(self):
+        """ Пересчет границ промежутков доставки по delivery_hours """
+
+        self.delivery_start, self.delivery_end = delivery_bounds(self.delivery_intervals)
+
     def set_assign_time(self, assign_time):
         """ Изменение времени одобрения заказа
 
@@ -228,10 +348,66 @@ class Order(models.Model):
         
         if not (self.courier or self.courier.id == courier_id):
             return
-        
-        self.complete_time = complete_time
-        self.save()
 
-        self.courier.order_completed()
+        if self.complete_time:
+            return self
+
+        with transaction.atomic():
+            self.complete_time = complete_time
+            self.save()
+
+            self.courier.order_completed(self)
 
         return self
+
+
+class OrderChange(models.Model):
+    """Журнал заказов, которые стали свободными или перестали быть свободными
+
+    По нему индексы свободных заказов в памяти воркеров (orders.index)
+    обновляются, перечитывая только изменившиеся заказы. Версия журнала -
+    id записи: он выдается без блокировок, поэтому записывающие транзакции
+    не ждут друг друга. Ведется, если включен OPEN_ORDER_INDEX.
+    """
+
+    order_id = models.IntegerField()
+
+    def __str__(self):
+        return "order %d changed in %d" % (self.order_id, self.id)
+
+    @staticmethod
+    def record(order_ids):
+        """Запись изменения заказов
+
+        Args:
+            order_ids (list[int]): id созданных, выданных или освобожденных заказов
+        """
+
+        if not order_ids or not getattr(settings, 'OPEN_ORDER_INDEX', False):
+            return
+
+        OrderChange.objects.bulk_create(
+            [OrderChange(order_id=i) for i in order_ids], batch_size=1000)
+
+    @staticmethod
+    def current_version():
+        return OrderChange.objects.aggregate(version=Max('id'))['version'] or 0
+
+    @staticmethod
+    def prune(keep):
+        """ Удаление записей журнала, кроме keep последних
+
+        Returns:
+            int: число удаленных записей
+        """
+
+        return OrderChange.objects.filter(
+            id__lte=OrderChange.current_version() - keep).delete()[0]
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def record_order_change(sender, instance, **kwargs):
+    """ Изменения заказов через save и delete (в том числе из админки) попадают в журнал """
+
+    OrderChange.record([instance.id])
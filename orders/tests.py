@@ -1,14 +1,37 @@
+import io
+import json
+import asyncio
+import threading
 import datetime
+from importlib import import_module
+from types import SimpleNamespace
+from decimal import Decimal
+from unittest import mock, skipIf
 
 from django.utils.dateparse import parse_datetime
 from django.utils import timezone
-from django.test import TestCase
+from django.db import connection, connections
+from django.db.models import Sum
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
 
-from couriers.models import Courier, Order, Region
+from asgiref.sync import async_to_sync
 
+from couriers.dispatch import claim_matches, dispatch_orders, match_orders
+from couriers.models import Courier, CourierStats, Order, Region, StatsUpdateJob
+from orders.models import OrderChange
+from orders.index import open_orders
+from orders.intervals import parse_hours, intervals_overlap
+from core.metrics import RequestSample, registry
+from core.responses import JsonResponse
+from core.testing import QueryBudgetMixin
+from core.asyncviews import AsyncViewsHandler
 
-class OrderTest(TestCase):
+
+class OrderTest(QueryBudgetMixin, TestCase):
     def setUp(self):
         r1 = Region.objects.create(
             name='Фрунзенская'
@@ -275,3 +298,774 @@ class OrderTest(TestCase):
 
         self.assertEqual(c.rating, 4.38)
         
+
+    def test_intervals_overlap(self):
+        working = parse_hours('09:00-10:00;12:00-14:30')
+
+        self.assertEqual(working, ((540, 600), (720, 870)))
+        self.assertTrue(intervals_overlap(working, parse_hours('08:00-09:01')))
+        self.assertTrue(intervals_overlap(working, parse_hours('06:00-07:00;14:00-15:00')))
+        self.assertFalse(intervals_overlap(working, parse_hours('10:00-12:00')))
+        self.assertFalse(intervals_overlap(working, parse_hours('')))
+
+    def test_order_post_without_valid_ids(self):
+        c = Client()
+        body = {'data': [
+            {'order_id': 7, 'weight': 1, 'region': 1, 'delivery_hours': ['09:00-18:00']},
+            {'order_id': [8], 'weight': 1, 'region': 1, 'delivery_hours': ['09:00-18:00']},
+            {'weight': 1, 'region': 1, 'delivery_hours': ['09:00-18:00']},
+            {'order_id': 9, 'weight': -1},
+        ]}
+
+        response = c.post('/orders/', json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.content)['validation_error']['orders']
+        self.assertEqual([(e['id'], e.get('position')) for e in errors], [(None, 1), (None, 2), (9, None)])
+        self.assertIn('order_id', errors[1]['errors'])
+        self.assertFalse(Order.objects.filter(id=7).exists())
+
+    def test_order_post_wrong_delivery_hours(self):
+        c = Client()
+        body = {
+            "data": [
+                {
+                    "order_id": 5,
+                    "weight": 0.23,
+                    "region": 1,
+                    "delivery_hours": ["9 утра"]
+                },
+            ]
+        }
+
+        response = c.post('/orders/', body)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            eval(response.content)['validation_error']['orders'][0]['errors'],
+            {'delivery_hours': {'code': 2, 'description': 'Не соответствует формату'}}
+        )
+
+    def test_order_post_out_of_range_delivery_hours(self):
+        c = Client()
+
+        for hours in ["23:00-24:59", "22:00-02:00", "10:00-10:00"]:
+            with self.subTest(hours=hours):
+                body = {'data': [{'order_id': 5, 'weight': 1, 'region': 1, 'delivery_hours': [hours]}]}
+                response = c.post('/orders/', json.dumps(body), content_type='application/json')
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    json.loads(response.content)['validation_error']['orders'][0]['errors'],
+                    {'delivery_hours': {'code': 2, 'description': 'Не соответствует формату'}})
+
+        body = {'data': [{'order_id': 5, 'weight': 1, 'region': 1, 'delivery_hours': ["23:00-24:00"]}]}
+        response = c.post('/orders/', json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_delivery_bounds_backfill(self):
+        fill = import_module('orders.migrations.0006_order_delivery_bounds').fill_delivery_bounds
+        r = Region.objects.get(id=1)
+
+        for hours in ["16:00-21:30;09:00-12:00", "22:00-01:00", "10:00-23:00;11:00-12:00", ""]:
+            Order.objects.create(weight=1, region=r, delivery_hours=hours)
+
+        # Как до миграции 0006: границ нет
+        Order.objects.update(delivery_start=0, delivery_end=0)
+
+        # Модели на момент миграции: без Order.save, который сам считает границы
+        state = MigrationExecutor(connection).loader.project_state(('orders', '0006_order_delivery_bounds'))
+        fill(state.apps, connection.schema_editor())
+
+        for order in Order.objects.all():
+            backfilled = (order.delivery_start, order.delivery_end)
+            order.set_delivery_bounds()
+
+            self.assertEqual(backfilled, (order.delivery_start, order.delivery_end))
+
+    def test_courier_stats_incremental_matches_rebuild(self):
+        c = Courier.objects.get(id=1)
+        r = Region.objects.get(id=1)
+
+        for start, end in [("9:00", "9:20"), ("9:30", "9:35"), ("10:00", "10:40")]:
+            o = Order.objects.create(
+                weight=0.23,
+                region=r,
+                delivery_hours="08:00-12:00",
+            )
+            o.assign(c, parse_datetime("2021-01-10T%s:00Z" % start))
+            o.save()
+            o.complete(c.id, parse_datetime("2021-01-10T%s:00Z" % end))
+
+        o.complete(c.id, parse_datetime("2021-01-10T11:00:00Z"))
+
+        incremental = Courier.objects.get(id=1)
+        self.assertEqual(incremental.earnings, 3000)
+
+        call_command('rebuild_courier_stats', '1', stdout=io.StringIO())
+        rebuilt = Courier.objects.get(id=1)
+
+        self.assertEqual(rebuilt.earnings, incremental.earnings)
+        self.assertEqual(rebuilt.rating, incremental.rating)
+        self.assertEqual(rebuilt.region_stats, incremental.region_stats)
+
+    def test_courier_stats_out_of_order_matches_rebuild(self):
+        c = Courier.objects.get(id=1)
+        r = Region.objects.get(id=1)
+        orders = []
+
+        for start in ["9:00", "9:00", "9:30"]:
+            o = Order.objects.create(
+                weight=0.23,
+                region=r,
+                delivery_hours="08:00-12:00",
+            )
+            o.assign(c, parse_datetime("2021-01-10T%s:00Z" % start))
+            o.save()
+            orders.append(o)
+
+        # Второй заказ завершен раньше первого, но о нем сообщили позже
+        for o, end in zip([orders[1], orders[0], orders[2]], ["9:50", "9:20", "10:00"]):
+            o.complete(c.id, parse_datetime("2021-01-10T%s:00Z" % end))
+
+        incremental = Courier.objects.get(id=1)
+        periods = list(CourierStats.objects.filter(courier=c)
+                        .values_list('period', 'region', 'orders_count', 'delivery_seconds'))
+
+        call_command('rebuild_courier_stats', '1', stdout=io.StringIO())
+        rebuilt = Courier.objects.get(id=1)
+
+        self.assertEqual(incremental.last_complete_time, parse_datetime("2021-01-10T10:00:00Z"))
+        self.assertEqual(rebuilt.rating, incremental.rating)
+        self.assertEqual(rebuilt.region_stats, incremental.region_stats)
+        self.assertEqual(
+            sorted(periods),
+            sorted(CourierStats.objects.filter(courier=c)
+                    .values_list('period', 'region', 'orders_count', 'delivery_seconds')))
+
+    def test_courier_stats_by_period(self):
+        c = Courier.objects.get(id=1)
+        r = Region.objects.get(id=1)
+
+        for day, start, end in [(11, "9:00", "9:20"), (11, "9:30", "9:40"), (12, "10:00", "11:30")]:
+            o = Order.objects.create(weight=0.23, region=r, delivery_hours="08:00-12:00")
+            o.assign(c, parse_datetime("2021-01-%dT%s:00Z" % (day, start)))
+            o.save()
+            o.complete(c.id, parse_datetime("2021-01-%dT%s:00Z" % (day, end)))
+
+        response = Client().get('/couriers/1/stats/', {'period': 'day'})
+        stats = json.loads(response.content)['stats']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([s['period_start'] for s in stats], ['2021-01-12', '2021-01-11'])
+        self.assertEqual([s['orders'] for s in stats], [1, 2])
+        self.assertEqual([s['earnings'] for s in stats], [1000, 2000])
+        self.assertEqual(stats[1]['rating'], 3.75)
+
+        with self.assertNumQueries(2):
+            response = Client().get('/couriers/1/stats/', {'period': 'week'})
+
+        weeks = json.loads(response.content)['stats']
+        self.assertEqual(weeks, [{
+            'period_start': '2021-01-11', 'orders': 3, 'earnings': 3000, 'rating': 0,
+        }])
+
+        call_command('rebuild_courier_stats', '1', stdout=io.StringIO())
+        rebuilt = json.loads(Client().get('/couriers/1/stats/', {'period': 'week'}).content)
+        self.assertEqual(rebuilt['stats'], weeks)
+
+        self.assertEqual(Client().get('/couriers/1/stats/', {'period': 'year'}).status_code, 400)
+
+    @override_settings(STATS_UPDATE_MODE='queue')
+    def test_courier_stats_queue(self):
+        c = Courier.objects.get(id=1)
+        r = Region.objects.get(id=1)
+
+        for start, end in [("9:00", "9:20"), ("9:30", "9:35")]:
+            o = Order.objects.create(weight=0.23, region=r, delivery_hours="08:00-12:00")
+            o.assign(c, parse_datetime("2021-01-10T%s:00Z" % start))
+            o.save()
+            o.complete(c.id, parse_datetime("2021-01-10T%s:00Z" % end))
+
+        self.assertEqual(Courier.objects.get(id=1).earnings, 0)
+        self.assertEqual(list(StatsUpdateJob.objects.values_list('courier', flat=True)), [1])
+
+        out = io.StringIO()
+        call_command('process_stats_jobs', '--once', stdout=out)
+
+        self.assertIn('1 курьеров', out.getvalue())
+        self.assertFalse(StatsUpdateJob.objects.exists())
+
+        courier = Courier.objects.get(id=1)
+        self.assertEqual(courier.earnings, 2000)
+        self.assertEqual(courier.rating, Decimal('3.75'))
+        self.assertEqual(courier.region_stats, {'1': [1800.0, 2]})
+
+    def test_courier_stats_queue_survives_errors(self):
+        broken = Courier.objects.create(courier_type='car', working_hours='07:00-12:00')
+
+        for courier in (broken, Courier.objects.get(id=1)):
+            StatsUpdateJob.enqueue(courier)
+
+        rebuild_stats = Courier.rebuild_stats
+
+        def fail_for_broken(courier):
+            if courier.id == broken.id:
+                raise ArithmeticError('overflow')
+
+            rebuild_stats(courier)
+
+        with mock.patch.object(Courier, 'rebuild_stats', fail_for_broken), \
+                self.assertLogs('couriers.models', 'ERROR'):
+            self.assertEqual(StatsUpdateJob.process(), 1)
+
+        self.assertEqual(list(StatsUpdateJob.objects.values_list('courier', flat=True)), [broken.id])
+
+    def test_order_post_failed_batch_saves_nothing(self):
+        c = Client()
+        body = {
+            "data": [
+                {
+                    "order_id": 5,
+                    "weight": 0.23,
+                    "region": 1,
+                    "delivery_hours": ["09:00-18:00"]
+                },
+                {
+                    "order_id": 6,
+                    "weight": 1,
+                    "region": 1,
+                    "delivery_hours": ["09:00-18:00"]
+                },
+                {
+                    "order_id": 5,
+                    "weight": "тяжелый",
+                    "region": 1,
+                    "delivery_hours": ["09:00-18:00"]
+                },
+            ]
+        }
+
+        response = c.post('/orders/', json.dumps(body), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            json.loads(response.content)['validation_error']['orders'],
+            [{'id': 5, 'errors': {
+                'order_id': {'code': 3, 'description': 'Некорректный идентификатор'},
+                'weight': {'code': 2, 'description': 'Не соответствует формату'},
+            }}]
+        )
+        self.assertFalse(Order.objects.filter(id__in=[5, 6]).exists())
+
+    def test_claim_orders_skips_taken(self):
+        courier = Courier.objects.get(id=1)
+        rival = Courier.objects.create(courier_type='car', working_hours='07:00-12:00')
+
+        candidates = list(courier.get_candidate_orders())
+        self.assertEqual([o.id for o in candidates], [1])
+
+        rival.claim_orders(list(rival.get_candidate_orders()) + candidates)
+
+        orders, assign_time = courier.claim_orders(candidates)
+
+        self.assertEqual(orders, [])
+        self.assertIsNone(assign_time)
+        self.assertEqual(Order.objects.get(id=1).courier, rival)
+
+    def test_assign_respects_lifting_capacity(self):
+        c = Client()
+        r = Region.objects.get(id=1)
+
+        for weight in [9, 6, 4, 3]:
+            Order.objects.create(weight=weight, region=r, delivery_hours="08:00-09:00")
+
+        response = c.post('/orders/assign/', {'courier_id': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(o['id'] for o in eval(response.content)['orders']),
+            [1, 3])
+
+        courier = Courier.objects.get(id=1)
+        self.assertEqual(courier.get_load(), Decimal('9.46'))
+
+        courier.patch({'courier_type': 'car'})
+        courier.assign_orders()
+        self.assertEqual(courier.get_load(), Decimal('22.23'))
+
+        courier.patch({'courier_type': 'foot'})
+        self.assertEqual(courier.get_load(), Decimal('9.23'))
+
+    def test_assign_locks_courier_before_load(self):
+        courier = Courier.objects.get(id=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            courier.assign_orders()
+
+        sql = [q['sql'] for q in queries.captured_queries]
+        lock = next(i for i, q in enumerate(sql) if q.startswith('UPDATE "couriers_courier"'))
+        load = next(i for i, q in enumerate(sql) if '"load"' in q)
+
+        # Загрузка читается в той же транзакции, после блокировки курьера
+        self.assertTrue(sql[0].startswith('SAVEPOINT') or sql[0] == 'BEGIN')
+        self.assertLess(lock, load)
+
+    def test_dispatch_locks_couriers_before_load(self):
+        with CaptureQueriesContext(connection) as queries:
+            dispatch_orders()
+
+        sql = [q['sql'] for q in queries.captured_queries]
+        lock = next(i for i, q in enumerate(sql) if q.startswith('UPDATE "couriers_courier"'))
+        load = next(i for i, q in enumerate(sql) if '"load"' in q)
+
+        # Как в assign: загрузка читается после блокировки курьеров
+        self.assertTrue(sql[0].startswith('SAVEPOINT') or sql[0] == 'BEGIN')
+        self.assertLess(lock, load)
+
+    def test_assign_without_query_params_limit(self):
+        # Как на PostgreSQL: ограничения на число параметров запроса нет
+        r = Region.objects.get(id=1)
+
+        for weight in [1, 2]:
+            Order.objects.create(weight=weight, region=r, delivery_hours="08:00-09:00")
+
+        no_limit = {'default': SimpleNamespace(features=SimpleNamespace(max_query_params=None))}
+
+        with mock.patch('orders.bulk.connections', no_limit):
+            response = Client().post('/orders/assign/', {'courier_id': 1})
+
+            self.assertEqual(sorted(o['id'] for o in json.loads(response.content)['orders']), [1, 3, 4])
+            self.assertEqual(Order.objects.filter(courier=1, complete_time__isnull=True).count(), 4)
+
+            Courier.objects.get(id=1).patch({'regions': [2]})
+
+        self.assertEqual(
+            sorted(Order.objects.filter(courier__isnull=True).values_list('id', flat=True)),
+            [1, 3, 4])
+
+    def test_json_response_backends_match(self):
+        data = {
+            'orders': [{'id': 1}],
+            'assign_time': parse_datetime("2021-01-10T08:33:01.421234Z"),
+            'rating': Decimal('4.42'),
+            'description': 'Некорректный идентификатор',
+        }
+
+        fast = JsonResponse(data).content
+
+        with mock.patch('core.responses.orjson', None):
+            stdlib = JsonResponse(data).content
+
+        self.assertEqual(json.loads(fast), json.loads(stdlib))
+        self.assertEqual(json.loads(fast)['assign_time'], '2021-01-10T08:33:01.421Z')
+        self.assertEqual(json.loads(fast)['rating'], '4.42')
+
+    def test_dispatch_orders(self):
+        r1, r2 = Region.objects.all()
+
+        bike = Courier.objects.create(courier_type='bike', working_hours='10:00-14:00')
+        bike.regions.add(r1, r2)
+
+        for weight, region, hours in [(9, r1, "08:00-09:00"), (6, r1, "08:30-11:00"),
+                                      (8, r2, "12:00-13:00"), (4, r2, "15:00-16:00")]:
+            Order.objects.create(weight=weight, region=region, delivery_hours=hours)
+
+        c = Client()
+        response = c.post('/orders/dispatch/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(d['id'], sorted(o['id'] for o in d['orders'])) for d in json.loads(response.content)['couriers']],
+            [(1, [1, 3]), (2, [4, 5])]
+        )
+
+        call_command('dispatch_orders', stdout=io.StringIO())
+        self.assertEqual(list(Order.objects.filter(courier__isnull=True).values_list('id', flat=True)), [6])
+
+    def test_orders_import_ndjson(self):
+        c = Client()
+
+        def post(lines):
+            response = c.post('/orders/import/', b'\n'.join(lines), content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 200)
+            return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        order = b'{"order_id": %d, "weight": 1, "region": 1, "delivery_hours": ["08:00-09:00"]}'
+
+        # Тело больше DATA_UPLOAD_MAX_MEMORY_SIZE, ограничена только строка
+        with mock.patch('orders.views.ORDERS_IMPORT_CHUNK_SIZE', 2), \
+                self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=100):
+            result = post([order % 3, b'', order % 4, order % 5, b'{"order_id": 6, "weight": 0}', order % 7])
+
+        self.assertEqual(result[0], {'chunk': 1, 'orders': [{'id': 3}, {'id': 4}]})
+        self.assertEqual(result[1]['chunk'], 2)
+        self.assertEqual([o['id'] for o in result[1]['validation_error']['orders']], [6])
+        self.assertEqual(result[2:], [
+            {'chunk': 3, 'orders': [{'id': 7}]},
+            {'created': 3, 'failed_chunks': 1},
+        ])
+        self.assertEqual(sorted(Order.objects.values_list('id', flat=True)), [1, 2, 3, 4, 7])
+
+        with self.settings(DATA_UPLOAD_MAX_MEMORY_SIZE=50):
+            result = post([order % 8])
+
+        self.assertEqual(result, [{'created': 0, 'failed_chunks': 0, 'error': 'Строка 1 больше 50 байт'}])
+
+        result = post([order % 8, b'[1]', order % 9])
+        self.assertEqual(result[-1]['error'], 'Строка 2: body: ожидается object')
+        self.assertFalse(Order.objects.filter(id__in=[8, 9]).exists())
+
+    def test_open_order_index(self):
+        c = Client()
+
+        def open_ids():
+            return [o.id for o in open_orders.snapshot()]
+
+        with self.settings(OPEN_ORDER_INDEX=True):
+            open_orders.reset()
+            self.addCleanup(open_orders.reset)
+
+            self.assertEqual(open_ids(), [1])
+
+            response = c.post('/orders/', json.dumps({'data': [
+                {'order_id': 3, 'weight': 9, 'region': 1, 'delivery_hours': ['08:00-09:00']},
+                {'order_id': 4, 'weight': 3, 'region': 1, 'delivery_hours': ['08:00-09:00']},
+                {'order_id': 5, 'weight': 2, 'region': 1, 'delivery_hours': ['13:00-14:00']},
+            ]}), content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+
+            # Новые заказы попадают в индекс по журналу, без полной перестройки
+            built = open_orders.built
+            self.assertEqual(open_ids(), [1, 3, 4, 5])
+            self.assertEqual(open_orders.built, built)
+
+            response = c.post('/orders/assign/', {'courier_id': 1})
+            self.assertEqual(sorted(o['id'] for o in json.loads(response.content)['orders']), [1, 3])
+            self.assertEqual(open_ids(), [4, 5])
+
+            courier = Courier.objects.get(id=1)
+            courier.patch({'working_hours': ['13:00-14:00']})
+            self.assertEqual(open_ids(), [1, 2, 3, 4, 5])
+
+            # Путь PostgreSQL: id из индекса блокируются SKIP LOCKED,
+            # заказы, уже выданные в базе, отбрасываются
+            with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', True):
+                Order.objects.filter(id=5).update(assign_time=timezone.now())
+                self.assertEqual(courier.assign_orders(), ([], None))
+
+                Order.objects.filter(id=5).update(assign_time=None)
+                orders, _ = courier.assign_orders()
+                self.assertEqual([o.id for o in orders], [5])
+
+            # Изменения через save и delete попадают в журнал сами
+            order = Order.objects.create(weight=1, region_id=1, delivery_hours='08:00-09:00')
+            self.assertIn(order.id, open_ids())
+            order.delete()
+            self.assertNotIn(order.id, open_ids())
+
+            # Запись с меньшим id журнала закоммитилась позже: пропуск перечитывается
+            with self.settings(OPEN_ORDER_INDEX=False):
+                late, early = [
+                    Order.objects.create(weight=1, region_id=1, delivery_hours='08:00-09:00')
+                    for _ in range(2)
+                ]
+
+            version = open_orders.version
+            OrderChange.objects.create(id=version + 2, order_id=early.id)
+            self.assertIn(early.id, open_ids())
+            self.assertNotIn(late.id, open_ids())
+
+            OrderChange.objects.create(id=version + 1, order_id=late.id)
+            self.assertIn(late.id, open_ids())
+            self.assertEqual(open_orders.gaps, {})
+
+            self.assertEqual(
+                open_ids(),
+                list(Order.objects.filter(assign_time__isnull=True).order_by('id').values_list('id', flat=True)))
+            self.assertEqual(open_orders.built, built)
+
+            call_command('prune_order_changes', keep=0, stdout=io.StringIO())
+            self.assertFalse(OrderChange.objects.exists())
+
+    def test_dispatch_without_query_params_limit(self):
+        for _ in range(9):
+            courier = Courier.objects.create(courier_type='car', working_hours='08:00-09:00')
+            courier.regions.add(1)
+
+        Order.objects.bulk_create([
+            Order(weight=1, region_id=1, delivery_hours='08:00-09:00',
+                  delivery_start=480, delivery_end=540)
+            for _ in range(450)
+        ])
+
+        no_limit = {'default': SimpleNamespace(features=SimpleNamespace(max_query_params=None))}
+
+        with mock.patch('orders.bulk.connections', no_limit), \
+                CaptureQueriesContext(connection) as queries:
+            result = dispatch_orders()
+
+        # Пачки CASE ограничены и без ограничения базы на число параметров
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "orders_order"')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(sum(len(orders) for orders, _ in result.values()), 451)
+        self.assertFalse(Order.objects.filter(courier__isnull=True).exists())
+
+    def test_dispatch_skips_taken_orders(self):
+        r1 = Region.objects.get(id=1)
+
+        for weight in [3, 4]:
+            Order.objects.create(weight=weight, region=r1, delivery_hours="08:00-09:00")
+
+        couriers = list(Courier.objects.prefetch_related('regions'))
+        matches = match_orders(couriers, list(Order.objects.filter(assign_time__isnull=True)), {1: Decimal('0.23')})
+        self.assertEqual([o.id for o in matches[couriers[0]]], [4, 3, 1])
+
+        # Заказ 3 забрал assign между подбором и записью
+        rival = Courier.objects.create(courier_type='car', working_hours='07:00-12:00')
+        rival.claim_orders([Order.objects.get(id=3)])
+
+        result = claim_matches(matches)
+
+        self.assertEqual([o.id for o in result[couriers[0]][0]], [4, 1])
+        self.assertEqual(Order.objects.get(id=4).courier_id, 1)
+        self.assertEqual(Order.objects.get(id=4).completed_courier_type, 'foot')
+        self.assertEqual(Order.objects.get(id=3).courier, rival)
+
+    @skipIf(connection.vendor != 'sqlite', 'план запроса проверяется на SQLite')
+    def test_hot_queries_use_indexes(self):
+        courier = Courier.objects.get(id=1)
+
+        loads = (Order.objects
+                    .filter(courier__isnull=False, complete_time__isnull=True)
+                    .values_list('courier')
+                    .annotate(load=Sum('weight')))
+
+        plans = [
+            ('order_open_region_idx', courier.get_candidate_orders()),
+            ('order_courier_complete_idx', courier.get_active_orders()),
+            ('order_courier_complete_idx', courier.get_completed_orders()),
+            ('order_in_progress_idx', loads),
+        ]
+
+        for index, queryset in plans:
+            self.assertIn('USING INDEX %s' % index, queryset.explain())
+
+    def test_assign_metrics(self):
+        registry.reset()
+        c = Client()
+
+        with self.assertNumQueries(8):
+            response = c.post('/orders/assign/', json.dumps({'courier_id': 1}),
+                              content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+
+        stats = registry.get('/orders/assign/', 'POST')
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(stats.statuses, {200: 1})
+        self.assertEqual(stats.queries, 8)
+        self.assertGreater(stats.serialization_time, 0)
+
+        metrics = c.get('/metrics/').content.decode()
+
+        self.assertIn('api_requests_total{endpoint="/orders/assign/",method="POST",status="200"} 1', metrics)
+        self.assertIn('api_db_queries_bucket{endpoint="/orders/assign/",method="POST",le="5"} 0', metrics)
+        self.assertIn('api_db_queries_bucket{endpoint="/orders/assign/",method="POST",le="8"} 1', metrics)
+        self.assertIn('api_db_queries_sum{endpoint="/orders/assign/",method="POST"} 8', metrics)
+        self.assertNotIn('endpoint="/metrics/"', metrics)
+
+        b''.join(c.get('/couriers/').streaming_content)
+        self.assertEqual(registry.get('/couriers/', 'GET').queries, 2)
+
+    def test_query_budget_post_orders(self):
+        c = Client()
+
+        def post(n):
+            body = {'data': [
+                {
+                    'order_id': 100 + i,
+                    'weight': 1,
+                    'region': 1,
+                    'delivery_hours': ['09:00-18:00'],
+                }
+                for i in range(n)
+            ]}
+
+            return lambda: c.post('/orders/', json.dumps(body), content_type='application/json')
+
+        # На SQLite bulk_create делит вставку на пачки по ~100 строк
+        self.assertQueryBudget(post, max_queries=6)
+
+    def test_query_budget_assign(self):
+        c = Client()
+
+        def assign(n):
+            Order.objects.bulk_create([
+                Order(weight=0.01, region_id=1, delivery_hours='08:00-09:00',
+                      delivery_start=480, delivery_end=540)
+                for _ in range(n)
+            ])
+
+            return lambda: c.post('/orders/assign/', json.dumps({'courier_id': 1}),
+                                  content_type='application/json')
+
+        # Включая блокировку строки курьера в транзакции выдачи
+        self.assertQueryBudget(assign, max_queries=8)
+
+    def test_query_budget_complete(self):
+        c = Client()
+        courier = Courier.objects.get(id=1)
+
+        def complete(n):
+            complete_time = parse_datetime('2021-01-10T10:00:00Z')
+
+            Order.objects.bulk_create([
+                Order(weight=0.01, region_id=1, delivery_hours='08:00-09:00', courier=courier,
+                      assign_time=complete_time, complete_time=complete_time,
+                      completed_courier_type='foot')
+                for _ in range(n)
+            ])
+
+            return lambda: c.post('/orders/complete/', json.dumps({
+                'courier_id': 1,
+                'order_id': 2,
+                'complete_time': '2021-01-10T11:00:00Z',
+            }), content_type='application/json')
+
+        self.assertQueryBudget(complete, max_queries=18)
+
+        with self.settings(STATS_UPDATE_MODE='queue'):
+            self.assertQueryBudget(complete, max_queries=7)
+
+    def test_query_budget_dispatch(self):
+        c = Client()
+
+        def dispatch(n):
+            for _ in range(n):
+                courier = Courier.objects.create(courier_type='car', working_hours='08:00-09:00')
+                courier.regions.add(1)
+
+            Order.objects.bulk_create([
+                Order(weight=1, region_id=1, delivery_hours='08:00-09:00',
+                      delivery_start=480, delivery_end=540)
+                for _ in range(n * 5)
+            ])
+
+            return lambda: c.post('/orders/dispatch/')
+
+        # Выдачи всем курьерам записываются через UPDATE ... CASE, не по курьеру:
+        # на SQLite (999 параметров) - по UPDATE на 199 заказов, для n = 100 их 3.
+        # Еще один запрос - блокировка курьеров перед чтением загрузки
+        counts = self.assertQueryBudget(dispatch, max_queries=10)
+        self.assertEqual(counts[1], counts[10])
+
+
+@override_settings(ROOT_URLCONF='config.urls_async')
+class AsyncViewsTest(TransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        region = Region.objects.create(name='Фрунзенская')
+
+        for courier_id in (1, 2):
+            courier = Courier.objects.create(courier_type='car', working_hours='07:00-12:00')
+            courier.regions.add(region)
+
+        for _ in range(4):
+            Order.objects.create(weight=20, region=region, delivery_hours='08:00-09:00')
+
+    async def test_async_views(self):
+        taken = []
+
+        for courier_id in (1, 2):
+            response = await self.async_client.post(
+                '/orders/assign/', {'courier_id': courier_id}, content_type='application/json')
+            taken.append([o['id'] for o in json.loads(response.content)['orders']])
+
+        self.assertEqual(taken, [[1, 2], [3, 4]])
+
+        responses = await asyncio.gather(
+            self.async_client.get('/couriers/1/'),
+            self.async_client.get('/couriers/2/'),
+        )
+
+        self.assertEqual(
+            [json.loads(r.content)['courier_id'] for r in responses], [1, 2])
+
+    async def test_async_streaming_response(self):
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/couriers/',
+            'query_string': b'',
+            'headers': [(b'host', b'testserver')],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await AsyncViewsHandler()(scope, receive, send)
+
+        self.assertEqual(messages[0]['status'], 200)
+
+        # Курьеры отправляются по мере генерации, а не одним телом
+        bodies = [m['body'] for m in messages[1:] if m.get('body')]
+        self.assertGreater(len(bodies), 2)
+        self.assertEqual(
+            [c['courier_id'] for c in json.loads(b''.join(bodies))['couriers']], [1, 2])
+        self.assertNotIn('more_body', messages[-1])
+
+    def test_streaming_metrics_match_wsgi(self):
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/couriers/',
+            'query_string': b'',
+            'headers': [(b'host', b'testserver')],
+        }
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            pass
+
+        registry.reset()
+
+        with self.settings(ROOT_URLCONF='config.urls'):
+            b''.join(Client().get('/couriers/').streaming_content)
+
+        expected = registry.get('/couriers/', 'GET').queries
+
+        registry.reset()
+        async_to_sync(AsyncViewsHandler())(scope, receive, send)
+
+        self.assertEqual(registry.get('/couriers/', 'GET').queries, expected)
+
+    def test_stream_parts_in_different_threads(self):
+        sample = RequestSample('GET')
+
+        def content():
+            for courier in list(Courier.objects.order_by('id')):
+                yield str(Order.objects.filter(courier=courier).count())
+
+        stream = sample.wrap_stream(content(), lambda sample: None)
+        parts = []
+
+        def step():
+            parts.append(next(stream, None))
+            connections.close_all()
+
+        # Как в AsyncViewsHandler.send_response: каждая часть - в своем потоке
+        while not parts or parts[-1] is not None:
+            thread = threading.Thread(target=step)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(parts, ['0', '0', None])
+        self.assertEqual(sample.queries, 3)
@@ -7,7 +7,9 @@ app_name = 'orders'
 
 urlpatterns = [
     path('', views.orders),
+    path('import/', views.orders_import),
     path('assign/', views.assign),
+    path('dispatch/', views.dispatch),
     path('complete/', views.complete),
 ]
 
@@ -1,20 +1,59 @@
-import json
 import datetime
+from itertools import islice
 
+from django.http import StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.dateparse import parse_datetime
-from django.http import JsonResponse
-from django.utils import timezone
 
+from couriers.dispatch import dispatch_orders
 from couriers.models import Courier, Order, Region
+from orders.bulk import ItemPosition
+from core.parsers import RequestDataError, compile_schema, decode_body, iter_json_lines
+from core.responses import JsonResponse, dumps
+
+
+ORDERS_IMPORT_CHUNK_SIZE = 1000
+
+ORDERS_SCHEMA = compile_schema({
+    'type': 'object',
+    'required': ['data'],
+    'properties': {
+        'data': {'type': 'array', 'items': {'type': 'object'}},
+    },
+})
+
+ORDER_LINE_SCHEMA = compile_schema({'type': 'object'})
+
+ASSIGN_SCHEMA = compile_schema({
+    'type': 'object',
+    'required': ['courier_id'],
+    'properties': {
+        'courier_id': {'type': 'integer'},
+    },
+})
+
+COMPLETE_SCHEMA = compile_schema({
+    'type': 'object',
+    'required': ['courier_id', 'order_id', 'complete_time'],
+    'properties': {
+        'courier_id': {'type': 'integer'},
+        'order_id': {'type': 'integer'},
+        'complete_time': {'type': 'string'},
+    },
+})
 
 
 def generate_objects_by_id(key, ids_list, problems=None):
-    values = [{'id': i} for i in ids_list]
+    """ Элементы без корректного id выдаются с id null и позицией в списке """
+
+    values = [
+        {'id': None, 'position': i.position} if isinstance(i, ItemPosition) else {'id': i}
+        for i in ids_list
+    ]
 
     if problems:
-        for d in values:
-            d['errors'] = problems[d['id']]
+        for i, d in zip(ids_list, values):
+            d['errors'] = problems[i]
 
     return {
         key: values
@@ -24,33 +63,19 @@ def generate_objects_by_id(key, ids_list, problems=None):
 @csrf_exempt
 def orders(request):
     if request.method == "POST":
-        problems = {} 
-        invalid_ids = []
-        orders = []
-
-        if not request.POST:
-            data_list = json.loads(request.body)['data']
-        else:
-            data_list = [eval(d) for d in request.POST.getlist('data')]
-        
-        for order_data in data_list:
-            order = Order.from_json(order_data)
-
-            if not isinstance(order, Order):
-                invalid_ids.append(order_data['order_id'])
-                problems[order_data['order_id']] = order
+        try:
+            data_list = decode_body(request, ORDERS_SCHEMA, form_lists=('data',))['data']
+        except RequestDataError as e:
+            return JsonResponse({'error': e.message}, status=e.status)
 
-            orders.append(order)
+        orders, problems = Order.bulk_from_json(data_list)
 
-        if invalid_ids:
+        if problems:
             return JsonResponse({
-                    'validation_error': generate_objects_by_id('orders', invalid_ids, problems)
+                    'validation_error': generate_objects_by_id('orders', list(problems), problems)
                 },
                 status=400)
 
-        for order in orders:
-            order.save()
-        
         return JsonResponse(
             generate_objects_by_id('orders', [o.id for o in orders]),
             status=201)
@@ -58,15 +83,69 @@ def orders(request):
     return JsonResponse({})
 
 
+def generate_import_json(request):
+    """Сохранение заказов из NDJSON пачками, по строке ответа на пачку
+
+    Каждая пачка сохраняется в своей транзакции, как POST /orders/:
+    если в пачке есть ошибки валидации, из нее ничего не сохраняется,
+    следующие пачки обрабатываются дальше. Последняя строка - итог.
+    """
+
+    lines = iter_json_lines(request, ORDER_LINE_SCHEMA)
+    summary = {'created': 0, 'failed_chunks': 0}
+    chunk_number = 0
+
+    try:
+        while True:
+            chunk = list(islice(lines, ORDERS_IMPORT_CHUNK_SIZE))
+
+            if not chunk:
+                break
+
+            chunk_number += 1
+            orders, problems = Order.bulk_from_json(chunk)
+
+            if problems:
+                summary['failed_chunks'] += 1
+                result = {'validation_error': generate_objects_by_id('orders', list(problems), problems)}
+            else:
+                summary['created'] += len(orders)
+                result = generate_objects_by_id('orders', [o.id for o in orders])
+
+            result['chunk'] = chunk_number
+            yield dumps(result) + b'\n'
+    except RequestDataError as e:
+        summary['error'] = e.message
+
+    yield dumps(summary) + b'\n'
+
+
+@csrf_exempt
+def orders_import(request):
+    """Загрузка заказов в формате NDJSON, по заказу на строку
+
+    Тело читается построчно и не ограничено DATA_UPLOAD_MAX_MEMORY_SIZE
+    (ограничена каждая строка), заказы сохраняются пачками по
+    ORDERS_IMPORT_CHUNK_SIZE. Ответ - NDJSON с результатом каждой пачки.
+    """
+
+    if request.method != "POST":
+        return JsonResponse({}, status=400)
+
+    return StreamingHttpResponse(
+        generate_import_json(request),
+        content_type='application/x-ndjson')
+
+
 @csrf_exempt
 def assign(request):
     if request.method == "GET":
         return JsonResponse({}, status=400)
     
-    if not request.POST:
-        data = json.loads(request.body)
-    else:
-        data = request.POST
+    try:
+        data = decode_body(request, ASSIGN_SCHEMA)
+    except RequestDataError as e:
+        return JsonResponse({'error': e.message}, status=e.status)
 
     courier_id = data['courier_id']
 
@@ -75,12 +154,7 @@ def assign(request):
     if not courier:
         return JsonResponse({'courier_id': {'code': 3, 'description': 'Некорректный id'}}, status=400)
 
-    order_list = []
-
-    for order in Order.objects.filter(assign_time__isnull=True):
-        if courier.can_assign_order(order):
-            order.set_courier(courier)
-            order_list.append(order)
+    order_list, assign_time = courier.assign_orders()
 
     if not order_list:
         return JsonResponse(
@@ -88,29 +162,47 @@ def assign(request):
             status=200
         )
 
-    assign_time = timezone.now()
-
-    for order in order_list:
-        order.set_assign_time(assign_time)
-        order.save()
-
     return JsonResponse({
         'orders': [{'id': o.id} for o in order_list],
         'assign_time': assign_time
     }, status=200)
     
 
+@csrf_exempt
+def dispatch(request):
+    if request.method != "POST":
+        return JsonResponse({}, status=400)
+
+    result = dispatch_orders()
+
+    return JsonResponse({
+        'couriers': [
+            {
+                'id': courier.id,
+                'orders': [{'id': o.id} for o in orders],
+                'assign_time': assign_time,
+            }
+            for courier, (orders, assign_time) in result.items()
+        ]
+    }, status=200)
+
+
 @csrf_exempt
 def complete(request):
     if request.method == "POST":
-        if not request.POST:
-            data = json.loads(request.body)
-        else:
-            data = request.POST
-        
+        try:
+            data = decode_body(request, COMPLETE_SCHEMA)
+            complete_time = parse_datetime(data['complete_time'])
+        except RequestDataError as e:
+            return JsonResponse({'error': e.message}, status=e.status)
+        except ValueError:
+            complete_time = None
+
+        if not complete_time:
+            return JsonResponse({}, status=400)
+
         courier_id = data['courier_id']
         order_id = data['order_id']
-        complete_time = parse_datetime(data['complete_time'])
 
         order = Order.objects.filter(id=order_id).first()
 